@@ -1,2 +1,2 @@
-from .finder import StringFinder, finders_from_model
+from .finder import StringFinder, finders_from_model, read_strings, cache_hit_rates
 from .model import CharacterModel, train_alpha_num, train_small_digit
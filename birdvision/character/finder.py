@@ -1,93 +1,131 @@
+import hashlib
+import json
+from collections import OrderedDict
+from concurrent.futures import Executor
 from dataclasses import dataclass
-from typing import List, Iterable
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
 from typing import Optional
 
 import cv2
 import numpy as np
 
 from birdvision.character.model import CharacterModel
+from birdvision.files import locked, replace_atomically
 from birdvision.node import Node
 from birdvision.rectangle import Rectangle
+from birdvision.stats import HitRate
 
 PREPARED_CHAR_DIMENSIONS = (32, 32)
 
 
-def _find_character_rects(img):
-    contours, _ = cv2.findContours(img.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    rects = [cv2.boundingRect(ctr) for ctr in contours]
+# The smallest and largest width and height of a character's contour
+MIN_CHAR_WIDTH = 5
+MIN_CHAR_HEIGHT = 9
+MAX_CHAR_SIZE = 40
+# How far apart two characters can be from the median, when finding the characters clustered around it
+MAX_MEDIAN_GAP = 25
 
-    # Filter out rects that are too small or large to be letters
-    filtered_rects = []
-    for (x, y, w, h) in rects:
-        if w < 5 or h < 9:
-            continue
-        if w > 40 or h > 40:
-            continue
-        filtered_rects.append((x, y, w, h))
-
-    # Stop early if no letters/numbers
-    if not filtered_rects:
-        return []
 
-    median_x = np.median([rect[0] for rect in filtered_rects])
-    rects_with_distance = [(abs(median_x - x), x, y, w, h) for (x, y, w, h) in filtered_rects]
+def _contour_rects(img) -> List[Tuple[int, int, int, int]]:
+    """The bounding rect of each outer contour in the image, as x, y, width and height."""
+    contours, _ = cv2.findContours(img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return [cv2.boundingRect(contour) for contour in contours]
 
-    # Sort rects by distance from median, so closest is first
-    rects_with_distance.sort(key=lambda rect: rect[0])
 
-    filtered_rects = []
-    prev_dist = rects_with_distance[0][0]
-    for (dist, x, y, w, h) in rects_with_distance:
-        if dist - prev_dist > 25:
-            break
-        prev_dist = dist
-        filtered_rects.append((x, y, w, h))
+def _find_character_rects_batch(contour_rects: List[List[Tuple[int, int, int, int]]]) -> List[List[Rectangle]]:
+    """
+    Finds the characters in many images at once, given each image's `_contour_rects`. Every image's rects go in one
+    array, and each step is done to all of them together, with `groups` saying which image a rect is from, so the cost
+    of each numpy call is paid once for a whole frame's finders rather than once per finder.
+    """
+    n = len(contour_rects)
+    rects = np.array([rect for image_rects in contour_rects for rect in image_rects], dtype=np.int64).reshape(-1, 4)
+    groups = np.repeat(np.arange(n), [len(image_rects) for image_rects in contour_rects])
+    out = [[] for _ in range(n)]
 
-    # Sort from left-right
-    filtered_rects.sort(key=lambda rect: rect[0])
-
-    out = []
-
-    # Find the minimum y so all letters can start there
-    min_y = min([rect[1] for rect in filtered_rects])
+    # Filter out rects that are too small or large to be letters
+    widths = rects[:, 2]
+    heights = rects[:, 3]
+    keep = (widths >= MIN_CHAR_WIDTH) & (heights >= MIN_CHAR_HEIGHT) & (np.maximum(widths, heights) <= MAX_CHAR_SIZE)
+    rects = rects[keep]
+    groups = groups[keep]
 
-    for (x, y, w, h) in filtered_rects:
-        # Adjust our bounds so that all rects start at min_y
-        diff_y = min_y - y
-        y = int(min_y)
-        h -= int(diff_y)
+    # Stop early if no letters/numbers
+    if len(rects) == 0:
+        return out
 
-        # Reject rects too tall after the extension
-        if h > 40:
-            continue
-        out.append(Rectangle(max(x - 1, 0), max(y - 1, 0), w + 2, h + 2))
+    # The median x of each image's rects. Both sorts here and below are stable, so ties keep the same order as the
+    # contours they came from, which is what the one image at a time version did.
+    xs = rects[:, 0]
+    counts = np.bincount(groups, minlength=n)
+    starts = np.cumsum(counts) - counts
+    present = counts > 0
+    sorted_xs = xs[np.lexsort((xs, groups))]
+    first, count = starts[present], counts[present]
+    median_x = np.zeros(n)
+    median_x[present] = (sorted_xs[first + (count - 1) // 2] + sorted_xs[first + count // 2]) / 2
+
+    # Keep the rects closest to their image's median, up until the first big gap in distance
+    distance = np.abs(median_x[groups] - xs)
+    by_distance = np.lexsort((distance, groups))
+    sorted_groups = groups[by_distance]
+    gap = np.zeros(len(by_distance), dtype=bool)
+    gap[1:] = (np.diff(distance[by_distance]) > MAX_MEDIAN_GAP) & (sorted_groups[1:] == sorted_groups[:-1])
+    gaps_so_far = np.cumsum(gap)
+    kept = by_distance[gaps_so_far == gaps_so_far[starts[sorted_groups]]]
 
+    # Sort from left-right
+    kept = kept[np.lexsort((xs[kept], groups[kept]))]
+
+    # Extend every rect up to its image's minimum y so all letters start there, and reject rects too tall after that
+    kept_groups = groups[kept]
+    group_starts = np.flatnonzero(np.diff(kept_groups, prepend=-1))
+    min_y = np.zeros(n, dtype=np.int64)
+    min_y[kept_groups[group_starts]] = np.minimum.reduceat(rects[kept, 1], group_starts)
+    min_y = min_y.tolist()
+    for group, (x, y, w, h) in zip(kept_groups.tolist(), rects[kept].tolist()):
+        h += y - min_y[group]
+        if h <= MAX_CHAR_SIZE:
+            out[group].append(Rectangle(max(x - 1, 0), max(min_y[group] - 1, 0), w + 2, h + 2))
     return out
 
 
-def _split_large_chars(chars: List[Node], rects: List[Rectangle]) -> Iterable[Node]:
-    extra = 0
-    for i, char in enumerate(chars):
+def _split_large_chars(chars: List[Node], rects: List[Rectangle]) -> Tuple[List[Node], List[Rectangle]]:
+    """
+    Splits each character too wide to be one into two, at the column with the least ink near its middle, as long as
+    that column is nearly empty. Returns the new characters, and their rects, where both halves of a split character
+    share the rect of the original.
+    """
+    wide = [i for i, char in enumerate(chars) if char.width >= 32]
+    if not wide:
+        return chars, rects
+
+    out_chars = []
+    out_rects = []
+    start = 0
+    for i in wide:
+        out_chars.extend(chars[start:i])
+        out_rects.extend(rects[start:i])
+        start = i + 1
+
+        char = chars[i]
         height, width = char.image.shape
-        if width < 32:
-            yield char
-            continue
-
         min_x = int(width / 3)
         max_x = int(width / 1.5)
-        center = char.image[:int(height * 0.60), min_x:max_x]
-        energy = center.sum(axis=0)
+        energy = char.image[:int(height * 0.60), min_x:max_x].sum(axis=0)
         min_seam = np.argmin(energy)
-
-        split_point = min_seam + min_x
-
         if energy[min_seam] < 128:
-            yield Node(char.image[:, :split_point], parents=[char], key=['split_left'])
-            yield Node(char.image[:, split_point:], parents=[char], key=['split_right'])
-            rects.insert(i + extra, rects[i + extra])
-            extra += 1
+            split_point = min_seam + min_x
+            out_chars.append(char.child(char.image[:, :split_point], key=['split_left']))
+            out_chars.append(char.child(char.image[:, split_point:], key=['split_right']))
+            out_rects.extend([rects[i], rects[i]])
         else:
-            yield char
+            out_chars.append(char)
+            out_rects.append(rects[i])
+    out_chars.extend(chars[start:])
+    out_rects.extend(rects[start:])
+    return out_chars, out_rects
 
 
 def _calculate_spaces(rects: List[Rectangle]):
@@ -123,38 +161,212 @@ class String:
         return int(s)
 
 
+class StringCache(HitRate):
+    """
+    A small LRU cache from the thresholded region a finder reads, to the String that was read out of it. A region
+    within `tolerance` pixels of the last one read also counts as a hit, to ride out a little noise in the stream.
+
+    Cached strings are detached from the frame they were read from, so the cache doesn't keep whole frames alive.
+
+    With a `path`, the cache is loaded from that file, and `save` writes it back, so that strings that come up again and
+    again, like unit names, are still cached after a restart. Strings loaded from disk have no character nodes.
+    """
+
+    def __init__(self, max_size: int = 16, tolerance: int = 2, path: Optional[str] = None):
+        self.max_size = max_size
+        self.tolerance = tolerance
+        self.path = path
+        self.entries = OrderedDict()
+        self.last_image: Optional[np.ndarray] = None
+        self.last_string: Optional[String] = None
+        self.hits = 0
+        self.misses = 0
+        if path is not None:
+            self.load()
+
+    @staticmethod
+    def key(image: np.ndarray):
+        return image.shape, hashlib.blake2b(image.tobytes(), digest_size=16).digest()
+
+    def get(self, image: np.ndarray) -> Optional[String]:
+        key = self.key(image)
+        string = self.entries.get(key)
+        if string is not None:
+            self.entries.move_to_end(key)
+        elif self.last_image is not None and self.last_image.shape == image.shape \
+                and np.count_nonzero(self.last_image != image) <= self.tolerance:
+            string = self.last_string
+
+        if string is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return string
+
+    def put(self, image: np.ndarray, string: String):
+        string = String(list(string.chars), list(string.confidences),
+                        [None if node is None else Node(node.image) for node in string.nodes])
+        self._insert(self.key(image), string)
+        self.last_image = image
+        self.last_string = string
+
+    def _insert(self, key, string: String):
+        self.entries[key] = string
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def _saved(self) -> Iterable[Tuple[Tuple, String]]:
+        path = Path(self.path)
+        if not path.exists():
+            return
+        for entry in json.loads(path.read_text()):
+            key = tuple(entry['shape']), bytes.fromhex(entry['digest'])
+            yield key, String(entry['chars'], entry['confidences'], [None] * len(entry['chars']))
+
+    def load(self):
+        """Adds every string saved at `path` to the cache, if anything has been saved there yet."""
+        for key, string in self._saved():
+            self._insert(key, string)
+
+    def save(self):
+        """
+        Writes every cached string to `path`, from least to most recently used. Several processes can share a path, such
+        as the pipeline's workers, so whatever is there already is kept too, behind this cache's own strings, and only
+        one process saves at a time.
+        """
+        path = Path(self.path)
+        with locked(path):
+            merged = OrderedDict(self._saved())
+            for key, string in self.entries.items():
+                merged[key] = string
+                merged.move_to_end(key)
+            while len(merged) > self.max_size:
+                merged.popitem(last=False)
+
+            entries = [{'shape': list(shape), 'digest': digest.hex(), 'chars': string.chars,
+                        'confidences': [float(confidence) for confidence in string.confidences]}
+                       for (shape, digest), string in merged.items()]
+            with replace_atomically(path) as f:
+                json.dump(entries, f)
+
+
+@dataclass
+class Segmentation:
+    """The characters a `StringFinder` has cut out of a frame, which haven't been read yet."""
+    finder: 'StringFinder'
+    prepared: Node
+    crops: List[Node]
+    spaces: List[int]
+    cached: Optional[String] = None
+
+    def to_string(self, chars: List[str], certainty: List[float]) -> String:
+        res = String([], [], [])
+        for i, char in enumerate(chars):
+            res.chars.append(char)
+            res.confidences.append(certainty[i])
+            res.nodes.append(self.crops[i])
+            if i in self.spaces:
+                res.chars.append(' ')
+                res.confidences.append(1.0)
+                res.nodes.append(None)
+        return res
+
+
 class StringFinder:
-    def __init__(self, name: str, rect: Rectangle, prepare_fn, reader_fn, find_spaces: bool = False):
+    def __init__(self, name: str, rect: Rectangle, prepare_fn, reader_fn, find_spaces: bool = False,
+                 cache_size: int = 16, cache_path: Optional[str] = None):
         self.name = name
         self.rect = rect
         self.prepare_fn = prepare_fn
         self.reader_fn = reader_fn
         self.find_spaces = find_spaces
+        self.cache = StringCache(cache_size, path=cache_path) if cache_size > 0 else None
 
     def __call__(self, frame: Node) -> String:
-        prepared_node = self.prepare_fn(frame, self.rect)
-        rects = _find_character_rects(prepared_node.image)
+        return read_strings([self], frame)[0]
+
+    def segment(self, frame: Node) -> Segmentation:
+        return segment_strings([self], frame)[0]
+
+    def segmentation(self, prepared_node: Node, rects: List[Rectangle]) -> Segmentation:
+        """Cuts the characters at `rects` out of the prepared image."""
         rect_crops = [prepared_node.crop(rect) for rect in rects]
-        split_chars = _split_large_chars(rect_crops, rects)
+        split_chars, rects = _split_large_chars(rect_crops, rects)
         final_crops = [char.thumbnail32 for char in split_chars]
-        chars, certainty = self.reader_fn([crop.image for crop in final_crops])
 
         if self.find_spaces:
             spaces = _calculate_spaces(rects)
         else:
             spaces = []
 
-        res = String([], [], [])
-        for i, char in enumerate(chars):
-            res.chars.append(char)
-            res.confidences.append(certainty[i])
-            res.nodes.append(final_crops[i])
-            if i in spaces:
-                res.chars.append(' ')
-                res.confidences.append(1.0)
-                res.nodes.append(None)
+        return Segmentation(self, prepared_node, final_crops, spaces)
+
+
+def segment_strings(finders: List[StringFinder], frame: Node,
+                    executor: Optional[Executor] = None) -> List[Segmentation]:
+    """
+    Segments every finder's characters out of the frame, other than the finders that have read the same image before.
+    The characters of every finder are picked out of their contours together, see `_find_character_rects_batch`.
+
+    With an `executor`, the steps done for each finder on its own run in parallel, which helps since OpenCV releases
+    the GIL. The frame should have a thread-safe `ChildCache` then, so that the steps the finders share only run once.
+    """
+    def prepare(finder: StringFinder):
+        prepared_node = finder.prepare_fn(frame, finder.rect)
+        cached = finder.cache.get(prepared_node.image) if finder.cache is not None else None
+        contour_rects = _contour_rects(prepared_node.image) if cached is None else None
+        return prepared_node, cached, contour_rects
+
+    mapper = map if executor is None else executor.map
+    prepared = list(mapper(prepare, finders))
+    uncached = [i for i, (_, cached, _) in enumerate(prepared) if cached is None]
+    all_rects = _find_character_rects_batch([prepared[i][2] for i in uncached])
+
+    segmentations = [Segmentation(finder, prepared_node, [], [], cached=cached)
+                     for finder, (prepared_node, cached, _) in zip(finders, prepared)]
+    cut = mapper(lambda i, rects: finders[i].segmentation(prepared[i][0], rects), uncached, all_rects)
+    for i, segmentation in zip(uncached, cut):
+        segmentations[i] = segmentation
+    return segmentations
+
+
+def read_strings(finders: List[StringFinder], frame: Node, executor: Optional[Executor] = None) -> List[String]:
+    """
+    Reads every finder's string out of the frame. Each finder is segmented first, and then the characters of every
+    finder that shares a reader are read in one call, since at these batch sizes the overhead of calling a model
+    costs far more than the model itself.
+
+    With an `executor`, the finders are segmented in parallel, see `segment_strings`.
+    """
+    segmentations = segment_strings(finders, frame, executor)
+
+    out = [segmentation.cached for segmentation in segmentations]
+    by_reader = {}
+    for i, segmentation in enumerate(segmentations):
+        if segmentation.cached is None:
+            by_reader.setdefault(segmentation.finder.reader_fn, []).append(i)
+
+    for reader_fn, indices in by_reader.items():
+        images = [crop.image for i in indices for crop in segmentations[i].crops]
+        chars, certainty = reader_fn(images)
+
+        offset = 0
+        for i in indices:
+            segmentation = segmentations[i]
+            end = offset + len(segmentation.crops)
+            out[i] = segmentation.to_string(chars[offset:end], certainty[offset:end])
+            offset = end
+
+            if segmentation.finder.cache is not None:
+                segmentation.finder.cache.put(segmentation.prepared.image, out[i])
 
-        return res
+    return out
+
+
+def cache_hit_rates(finders: List[StringFinder]) -> Dict[str, float]:
+    """The hit rate of each finder's `StringCache`, by the finder's name."""
+    return {finder.name: finder.cache.hit_rate for finder in finders if finder.cache is not None}
 
 
 def light_text(frame: Node, rect: Rectangle):
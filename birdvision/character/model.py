@@ -4,47 +4,166 @@ to train the models in the first place.
 """
 
 import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
 
 import numpy as np
 
+from birdvision import startup
+from birdvision.inference import load_engine
+from birdvision.stats import HitRate
+
 SMALL_DIGIT_CHARSET = "0123456789"
 ALPHA_NUM_CHARSET = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ+"
 
+# How certain the model has to be of a character before its glyph is added to a `GlyphIndex`
+LEARN_CERTAINTY = 0.999
+
 
 def _read_model(model, charset, characters):
-    if characters is None:
-        return []
+    if not characters:
+        return [], []
     y_pred = model(np.array([char / 255.0 for char in characters]))
     chars = [charset[i] for i in np.argmax(y_pred, axis=1)]
     certainty = np.max(y_pred, axis=1)
     return chars, certainty
 
 
+class GlyphIndex(HitRate):
+    """
+    An exact match lookup table from a binarized 32x32 character to the character it is. FFT's fonts are pixel fonts,
+    so the same character thresholds to the same glyph nearly every time, and looking it up is far cheaper than
+    running a model over it.
+
+    A glyph that's been labelled as two different characters is ambiguous, and never matches. Glyphs the model is
+    certain enough of can be `learn`ed at runtime, up to `max_learned` of them, so noise in the stream can't grow the
+    table forever.
+    """
+
+    AMBIGUOUS = -1
+
+    def __init__(self, charset: str, max_learned: int = 4096):
+        self.charset = charset
+        self.max_learned = max_learned
+        self.table: Dict[bytes, int] = {}
+        self.learned = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(character: np.ndarray) -> bytes:
+        return np.packbits(character > 127).tobytes()
+
+    def add(self, character: np.ndarray, index: int):
+        key = self.key(character)
+        if self.table.setdefault(key, index) != index:
+            self.table[key] = GlyphIndex.AMBIGUOUS
+
+    def learn(self, characters, indices, certainty):
+        """Adds the characters the model was certain of, other than glyphs that are already in the table."""
+        for character, index, sure in zip(characters, indices, certainty):
+            if self.learned >= self.max_learned:
+                return
+            if sure < LEARN_CERTAINTY:
+                continue
+            key = self.key(character)
+            if key not in self.table:
+                self.table[key] = int(index)
+                self.learned += 1
+
+    def lookup(self, characters) -> List[Optional[int]]:
+        """The index in the charset of each character, or None for the ones that aren't in the table."""
+        out = []
+        for character in characters:
+            index = self.table.get(self.key(character), GlyphIndex.AMBIGUOUS)
+            out.append(None if index == GlyphIndex.AMBIGUOUS else index)
+        matched = sum(index is not None for index in out)
+        self.hits += matched
+        self.misses += len(out) - matched
+        return out
+
+    @staticmethod
+    def from_labelled(src: str, charset: str) -> 'GlyphIndex':
+        """An index of every character in a labelled directory, or an empty one if the directory isn't there."""
+        index = GlyphIndex(charset)
+        if Path(src).is_dir():
+            xs, ys = _load_labelled_characters(src, charset)
+            for character, label in zip(xs, ys):
+                index.add(character, int(label))
+        return index
+
+
+def _read_indexed(index: GlyphIndex, model, characters):
+    """Reads each character from the index if it's there, and only runs the model over the rest."""
+    if not characters:
+        return [], []
+    found = index.lookup(characters)
+    chars = [None if i is None else index.charset[i] for i in found]
+    certainty = np.array([1.0 if i is not None else 0.0 for i in found])
+
+    missed = [i for i, found_index in enumerate(found) if found_index is None]
+    if missed:
+        unmatched = [characters[i] for i in missed]
+        y_pred = model(np.array([char / 255.0 for char in unmatched]))
+        predicted = np.argmax(y_pred, axis=1)
+        for i, char_index, sure in zip(missed, predicted, np.max(y_pred, axis=1)):
+            chars[i] = index.charset[char_index]
+            certainty[i] = sure
+        index.learn(unmatched, predicted, np.max(y_pred, axis=1))
+    return chars, certainty
+
+
 class CharacterModel:
     """
     CharacterModel encapsulates two tensorflow models, one for FFT's small digit font (for HP/MP/CT etc) and it's
-    general purpose font used for all other text.
+    general purpose font used for all other text. Small digits are looked up in a `GlyphIndex` of the labelled ones
+    first, so the model only sees the few glyphs that aren't in it. The index is built on the first read, so it doesn't
+    slow down starting up.
 
     The character arrays mentioned are supposed to be 32x32 uint8 arrays that have already been preprocessed.
     """
 
     def __init__(self):
-        import tensorflow as tf
-        self.small_digit_model = tf.keras.models.load_model(os.environ['SMALL_DIGIT_MODEL'])
-        self.alphanum_model = tf.keras.models.load_model(os.environ['ALPHA_NUM_MODEL'])
+        self.small_digit_model = load_engine(os.environ['SMALL_DIGIT_MODEL'])
+        self.alphanum_model = load_engine(os.environ['ALPHA_NUM_MODEL'])
+        self._small_digit_index: Optional[GlyphIndex] = None
+        self._small_digit_index_lock = threading.Lock()
+
+    @property
+    def small_digit_index(self) -> GlyphIndex:
+        """The index of labelled small digits, which is only read from disk the first time it's needed."""
+        with self._small_digit_index_lock:
+            if self._small_digit_index is None:
+                with startup.phase('load small digit glyphs'):
+                    self._small_digit_index = GlyphIndex.from_labelled(os.environ['SMALL_DIGIT_SRC'],
+                                                                       SMALL_DIGIT_CHARSET)
+            return self._small_digit_index
+
+    @small_digit_index.setter
+    def small_digit_index(self, index: GlyphIndex):
+        self._small_digit_index = index
 
     def read_small_digits(self, characters):
-        return _read_model(self.small_digit_model, SMALL_DIGIT_CHARSET, characters)
+        return _read_indexed(self.small_digit_index, self.small_digit_model, characters)
 
     def read_alpha_num(self, characters):
         return _read_model(self.alphanum_model, ALPHA_NUM_CHARSET, characters)
 
 
-def _load_labelled_characters(src, charset):
-    from pathlib import Path
+def _read_character(path: Path) -> np.ndarray:
     import cv2
-    xs = []
-    ys = []
+    return cv2.cvtColor(cv2.imread(path.as_posix()), cv2.COLOR_BGR2GRAY)
+
+
+def _read_characters(paths: List[Path]) -> np.ndarray:
+    from birdvision.loader import imap_ordered
+    return np.array(list(imap_ordered(_read_character, paths)))
+
+
+def _load_labelled_characters(src, charset):
+    from birdvision.dataset import load_dataset
+    files = []
 
     for path in Path(src).iterdir():
         if path.name[0] == '.':
@@ -55,12 +174,9 @@ def _load_labelled_characters(src, charset):
         char = path.name[-1]
         index = charset.index(char)
         for image_path in path.glob('*.png'):
-            image = cv2.imread(image_path.as_posix())
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            xs.append(gray)
-            ys.append(index)
+            files.append((image_path, index))
 
-    return np.array(xs), np.array(ys)
+    return load_dataset(Path(src).name, files, _read_characters)
 
 
 def _train(src, charset, dst):
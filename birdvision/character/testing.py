@@ -12,6 +12,9 @@ def run():
     test_cases = json.loads(Path('data/tests/character.json').read_text())
     char_model = character.CharacterModel()
     char_finders = character.finders_from_model(char_model)
+    for finder in char_finders:
+        # Every case should be read from scratch, rather than out of the cache of an earlier case
+        finder.cache = None
     by_name = {finder.name: finder for finder in char_finders}
 
     for fp, case in test_cases.items():
@@ -0,0 +1,83 @@
+"""
+Packs a labelled dataset into a cache of `.npy` arrays, so that training and testing can memory map thousands of
+labelled images in milliseconds, rather than decoding every one of them each time.
+
+Each dataset is three files in DATASET_CACHE: the prepared images, their labels, and a manifest of the file each row
+came from, with that file's modification time. When files are added, removed or changed, only those files are loaded
+again, and every other row is copied over from the last build. Only the files are checked, not the code that prepares
+them, so delete the cache after changing how a dataset is prepared.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from birdvision.files import locked, replace_atomically
+
+
+def cache_dir() -> Optional[Path]:
+    """Where packed datasets go, or None if DATASET_CACHE isn't set, in which case nothing is cached."""
+    path = os.environ.get('DATASET_CACHE')
+    return None if path is None else Path(path)
+
+
+def _load_all(files: List[Tuple[Path, int]], load: Callable[[List[Path]], np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    xs = load([path for path, _ in files])
+    return xs, np.array([label for _, label in files])
+
+
+def load_dataset(name: str, files: List[Tuple[Path, int]],
+                 load: Callable[[List[Path]], np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the prepared images and labels of `files`, a list of each file and its label, in the same order. `load`
+    prepares a list of files as one array, with a row for each file.
+
+    The images are a read only memory map of the packed dataset called `name`, which is rebuilt first if any of the
+    files have changed since it was packed.
+    """
+    root = cache_dir()
+    if root is None or not files:
+        return _load_all(files, load)
+
+    images_path = root / f'{name}.npy'
+    labels_path = root / f'{name}.labels.npy'
+    manifest_path = root / f'{name}.json'
+    manifest = [[path.as_posix(), path.stat().st_mtime_ns, label] for path, label in files]
+
+    # Several processes can load the same dataset at once, like the pipeline's workers, so only one of them checks and
+    # builds it at a time, and the rest find it already up to date
+    with locked(manifest_path):
+        packed = {}
+        if manifest_path.exists() and images_path.exists() and labels_path.exists():
+            old_manifest = json.loads(manifest_path.read_text())
+            if old_manifest == manifest:
+                return np.load(images_path, mmap_mode='r'), np.load(labels_path)
+            packed = {(path, mtime, label): row for row, (path, mtime, label) in enumerate(old_manifest)}
+
+        reused = [packed.get(tuple(entry)) for entry in manifest]
+        missing = [i for i, row in enumerate(reused) if row is None]
+        loaded = load([files[i][0] for i in missing]) if missing else None
+        if len(missing) == len(files):
+            xs = loaded
+        else:
+            old_xs = np.load(images_path, mmap_mode='r')
+            xs = np.empty((len(files), *old_xs.shape[1:]), dtype=old_xs.dtype)
+            kept = [i for i, row in enumerate(reused) if row is not None]
+            xs[kept] = old_xs[[reused[i] for i in kept]]
+            if missing:
+                xs[missing] = loaded
+            del old_xs
+        ys = np.array([label for _, label in files])
+
+        # Each file is written to the side and then moved, so a build that's interrupted can't leave a mismatched set
+        # behind, and the manifest goes last, since it's what says the other two are up to date
+        for path, array in [(images_path, xs), (labels_path, ys)]:
+            with replace_atomically(path, 'wb') as f:
+                np.save(f, array)
+        with replace_atomically(manifest_path) as f:
+            json.dump(manifest, f)
+
+        return np.load(images_path, mmap_mode='r'), ys
@@ -0,0 +1,43 @@
+"""
+Writing files that other processes might be writing or reading at the same time.
+"""
+
+import fcntl
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+
+@contextmanager
+def replace_atomically(path: Path, mode: str = 'w'):
+    """
+    Opens a new file next to `path` to write instead, which replaces `path` in one step at the end of the `with` block,
+    so nothing can read a partly written file. Every writer gets a file of its own, so processes writing the same path
+    at once can't move or truncate each other's, and whichever finishes last wins. If the block raises, `path` is left
+    as it was.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    f = tempfile.NamedTemporaryFile(mode, dir=path.parent, prefix=f'.{path.name}.', suffix='.tmp', delete=False)
+    tmp = Path(f.name)
+    try:
+        with f:
+            yield f
+        tmp.replace(path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+@contextmanager
+def locked(path: Path):
+    """
+    Holds an exclusive lock on `path` for the `with` block, shared between processes, for reading a file and writing it
+    back without another process writing it in between. The lock is a file of its own next to `path`.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_name(path.name + '.lock'), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,150 @@
+"""
+Inference engines for our models. An engine is a callable that takes a batch of float inputs and returns the model's
+predictions as a numpy array.
+
+Calling a keras model eagerly costs a few milliseconds of dispatch per call, which dwarfs the actual work for models
+this small. Our small sequential models can run in plain numpy instead, which also means never importing tensorflow.
+Anything else can be exported to a compiled `.tflite` file next to its `.h5`, with
+`python -m birdvision.scripts.export_models`, and `load_engine` will use that when it's there and up to date.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+from birdvision import startup
+from birdvision.numpy_model import NumpyModel, UnsupportedModel
+
+BACKENDS = ['auto', 'keras', 'tflite', 'numpy']
+
+
+def tflite_path(model_path: str) -> Path:
+    return Path(model_path).with_suffix('.tflite')
+
+
+def has_fresh_export(model_path: str) -> bool:
+    """Whether the model has a `.tflite` export that's at least as new as the model itself."""
+    compiled = tflite_path(model_path)
+    return compiled.exists() and compiled.stat().st_mtime >= Path(model_path).stat().st_mtime
+
+
+class KerasEngine:
+    """Runs a keras model through a `tf.function` with a fixed signature, so every call reuses one traced graph."""
+
+    def __init__(self, model_path: str):
+        tf = startup.import_tensorflow()
+        self.model = tf.keras.models.load_model(model_path)
+        spec = tf.TensorSpec([None, *self.model.input_shape[1:]], tf.float32)
+        self.fn = tf.function(lambda x: self.model(x, training=False), input_signature=[spec])
+
+    def __call__(self, batch) -> np.ndarray:
+        return self.fn(np.asarray(batch, dtype=np.float32)).numpy()
+
+
+class TFLiteEngine:
+    """
+    Runs an exported `.tflite` model. The standalone `tflite_runtime` package is used when it's installed, since it
+    doesn't have to import all of tensorflow.
+    """
+
+    def __init__(self, path: Path):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            Interpreter = startup.import_tensorflow().lite.Interpreter
+
+        self.interpreter = Interpreter(model_path=path.as_posix())
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self.shape = None
+
+    def __call__(self, batch) -> np.ndarray:
+        batch = np.asarray(batch, dtype=np.float32)
+        if batch.shape != self.shape:
+            self.interpreter.resize_tensor_input(self.input_index, batch.shape)
+            self.interpreter.allocate_tensors()
+            self.shape = batch.shape
+        self.interpreter.set_tensor(self.input_index, batch)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index)
+
+
+class LazyEngine:
+    """Loads its engine on first use, so that starting up doesn't pay for a model until it's actually needed."""
+
+    def __init__(self, model_path: str):
+        self.model_path = model_path
+        self.engine = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            if self.engine is None:
+                self.engine = _load_engine(self.model_path)
+        return self.engine
+
+    def __call__(self, batch) -> np.ndarray:
+        engine = self.engine or self.load()
+        return engine(batch)
+
+
+def _load_engine(model_path: str):
+    backend = os.environ.get('INFERENCE_BACKEND', 'auto')
+    if backend not in BACKENDS:
+        raise Exception(f'unknown INFERENCE_BACKEND "{backend}"')
+
+    with startup.phase(f'load {model_path}'):
+        if backend == 'numpy':
+            return NumpyModel(model_path)
+        if backend == 'auto':
+            try:
+                return NumpyModel(model_path)
+            except UnsupportedModel:
+                pass
+
+        if backend == 'tflite' or (backend == 'auto' and has_fresh_export(model_path)):
+            return TFLiteEngine(tflite_path(model_path))
+        return KerasEngine(model_path)
+
+
+def load_engine(model_path: str) -> LazyEngine:
+    """
+    Returns an engine for the model at `model_path`, preferring numpy when it supports the model, then an up to date
+    `.tflite` export, and then keras. The `INFERENCE_BACKEND` environment variable can force a particular backend,
+    which is one of `BACKENDS`.
+
+    The model is only loaded when the engine is first called, or when it's passed to `preload_engines`, so that
+    several models can be loaded at once.
+    """
+    return LazyEngine(model_path)
+
+
+def lazy_models() -> bool:
+    """
+    Whether the `LAZY_MODELS` environment variable asks for each model to be loaded when it's first needed, rather
+    than all together at startup.
+    """
+    return bool(os.environ.get('LAZY_MODELS'))
+
+
+def preload_engines(engines: List):
+    """Loads every lazy engine that hasn't been loaded yet, all at once in a thread pool."""
+    lazy_engines = [engine for engine in engines if isinstance(engine, LazyEngine) and engine.engine is None]
+    if not lazy_engines:
+        return
+    with ThreadPoolExecutor(max_workers=len(lazy_engines)) as executor:
+        list(executor.map(LazyEngine.load, lazy_engines))
+
+
+def export_tflite(model_path: str) -> Path:
+    """Compiles the keras model at `model_path` into a `.tflite` file next to it, and returns the new file's path."""
+    tf = startup.import_tensorflow()
+    model = tf.keras.models.load_model(model_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    compiled = tflite_path(model_path)
+    compiled.write_bytes(converter.convert())
+    return compiled
@@ -0,0 +1,73 @@
+"""
+Decodes images on a pool of threads, for anything that reads a whole directory of them. OpenCV releases the GIL while it
+decodes, so threads scale with cores without the cost of sending every image between processes.
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+import cv2
+import numpy as np
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+def imap_ordered(f: Callable[[T], R], items: Iterable[T], threads: Optional[int] = None) -> Iterator[R]:
+    """
+    Yields `f` of each item, in the same order as the items, while `f` runs on the items after it in a pool of threads.
+    Only a few items per thread are worked on ahead of the one being yielded, so a slow consumer doesn't end up with
+    every result in memory at once.
+    """
+    threads = threads or os.cpu_count()
+    with ThreadPoolExecutor(threads, thread_name_prefix='loader') as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(f, item))
+            if len(pending) >= threads * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def read_image(path: Path) -> Optional[np.ndarray]:
+    """Reads a BGR image, or returns None if it can't be decoded."""
+    image = cv2.imread(path.as_posix())
+    if image is None or image.size == 0:
+        return None
+    return image
+
+
+def read_images(paths: Iterable[Path], threads: Optional[int] = None) -> Iterator[Optional[np.ndarray]]:
+    """Every image in `paths` in order, or None in place of the ones that couldn't be decoded."""
+    return imap_ordered(read_image, paths, threads)
+
+
+def read_thumbnails(paths: List[Path], thumbnail: Callable[[np.ndarray], np.ndarray], dst: Path,
+                    threads: Optional[int] = None) -> Tuple[np.ndarray, List[Path]]:
+    """
+    Decodes every image once, and writes `thumbnail` of each one as a row of a memory mapped `.npy` matrix at `dst`,
+    for going over the same images more than once without decoding them again. Returns the matrix, and the path each
+    row came from, which leaves out the images that couldn't be decoded, so the two always line up.
+    """
+    def read(path: Path) -> Tuple[Path, Optional[np.ndarray]]:
+        image = read_image(path)
+        return path, None if image is None else thumbnail(image)
+
+    matrix = None
+    rows = []
+    for path, row in imap_ordered(read, paths, threads):
+        if row is None:
+            continue
+        if matrix is None:
+            matrix = np.lib.format.open_memmap(dst, mode='w+', dtype=row.dtype, shape=(len(paths), *row.shape))
+        matrix[len(rows)] = row
+        rows.append(path)
+
+    if matrix is None:
+        return np.empty((0, 0), dtype=np.uint8), rows
+    matrix.flush()
+    return matrix[:len(rows)], rows
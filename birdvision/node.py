@@ -1,3 +1,6 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
 from typing import Callable, Iterable, List
 from typing import Optional
 from uuid import UUID
@@ -6,21 +9,139 @@ import cv2
 import numpy as np
 
 from birdvision.rectangle import Rectangle
+from birdvision.stats import HitRate
+
+
+# Whether new frames keep their lineage unless they're told otherwise, see `Node`
+KEEP_LINEAGE = True
+
+
+def set_keep_lineage(keep: bool):
+    """
+    Sets whether new frames keep their lineage by default. The test framework and its viewer need it, but nothing
+    else does, so anything that only watches the stream can turn it off.
+    """
+    global KEEP_LINEAGE
+    KEEP_LINEAGE = keep
+
+
+@dataclass
+class MemoStats(HitRate):
+    """
+    How often memoized children were reused, shared between every `ChildCache` in a graph, for profiling. The counts
+    can be slightly off when several threads update them at once.
+    """
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+class ChildCache:
+    """
+    Holds a node's memoized children in place of the plain dict that nodes use by default, for nodes that are shared
+    between threads, or that live long enough that their children need to be bounded.
+
+    When `thread_safe` is set, two threads asking for the same child at once compute it once: the second one waits for
+    the first one's result. When `max_size` is set, the least recently used child is evicted past that many. Every
+    node made from a node with a `ChildCache` gets its own with the same settings, and the same `stats`.
+    """
+
+    def __init__(self, max_size: Optional[int] = None, thread_safe: bool = True, stats: Optional[MemoStats] = None):
+        self.max_size = max_size
+        self.thread_safe = thread_safe
+        self.stats = stats if stats is not None else MemoStats()
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock() if thread_safe else None
+        # The children being computed right now, by key, so other threads can wait for them instead
+        self.pending = {}
+
+    def spawn(self) -> 'ChildCache':
+        return ChildCache(self.max_size, self.thread_safe, self.stats)
+
+    def values(self) -> Iterable['Node']:
+        if self.lock is None:
+            return list(self.entries.values())
+        with self.lock:
+            return list(self.entries.values())
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _lookup(self, key) -> Optional['Node']:
+        child = self.entries.get(key)
+        if child is not None:
+            self.entries.move_to_end(key)
+            self.stats.hits += 1
+        return child
+
+    def _store(self, key, child: 'Node'):
+        self.entries[key] = child
+        self.stats.misses += 1
+        if self.max_size is not None and len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def get_or_create(self, key, create: Callable[[], 'Node']) -> 'Node':
+        if self.lock is None:
+            child = self._lookup(key)
+            if child is None:
+                child = create()
+                self._store(key, child)
+            return child
+
+        while True:
+            with self.lock:
+                child = self._lookup(key)
+                if child is not None:
+                    return child
+                done = self.pending.get(key)
+                if done is None:
+                    done = self.pending[key] = threading.Event()
+                    break
+            # Another thread is already making this child, so wait for it and look again. If it failed, this thread
+            # gets to try instead
+            done.wait()
+
+        try:
+            child = create()
+            with self.lock:
+                self._store(key, child)
+            return child
+        finally:
+            with self.lock:
+                del self.pending[key]
+            done.set()
 
 
 class Node:
     """
     A lazily computed image node. Each accessor generates another node that is memorized, allowing us to review
     each step in our computation.
+
+    A node that doesn't keep its lineage still memorizes its children, so each step only runs once per frame, but it
+    doesn't record its parents or how it was made, so nothing can be reviewed afterwards. Every node made from it
+    inherits the same setting.
     """
-    test_uuid: Optional[UUID] = None
-    test_result: Optional[object] = None
+    __slots__ = ('image', 'parents', 'key', 'children', 'lineage', 'test_uuid', 'test_result')
 
-    def __init__(self, image: np.ndarray, parents: Optional[List['Node']] = None, key=None):
+    def __init__(self, image: np.ndarray, parents: Optional[List['Node']] = None, key=None,
+                 lineage: Optional[bool] = None, children: Optional[ChildCache] = None):
         self.image = image
-        self.parents = parents
-        self.key = key
-        self.children = {}
+        self.lineage = KEEP_LINEAGE if lineage is None else lineage
+        self.parents = parents if self.lineage else None
+        self.key = key if self.lineage else None
+        # Unless there's a ChildCache, a plain dict is created along with the first child, since most nodes never
+        # have any
+        self.children = children
+        self.test_uuid: Optional[UUID] = None
+        self.test_result: Optional[object] = None
+
+    def child(self, image: np.ndarray, key=None) -> 'Node':
+        """A new node made from this one, which keeps its lineage and the kind of child cache this one has."""
+        children = self.children.spawn() if isinstance(self.children, ChildCache) else None
+        if self.lineage:
+            return Node(image, parents=[self], key=key, lineage=True, children=children)
+        return Node(image, lineage=False, children=children)
 
     def ancestors(self) -> Iterable['Node']:
         if not self.parents:
@@ -33,6 +154,8 @@ class Node:
         yield from self.ancestors()
 
     def descendents(self) -> Iterable['Node']:
+        if not self.children:
+            return
         for child in self.children.values():
             yield from child.descendents_and_me()
 
@@ -101,6 +224,9 @@ def memoized_node(func: Callable[..., np.ndarray]):
     have the same name as well.
 
     All arguments to the function should support being a dictionary key, and kwargs are not supported.
+
+    Children are kept in a plain dict unless the node has a `ChildCache`, which makes it safe to share between
+    threads, and can bound how many children it keeps.
     """
     assert func.__name__ not in NODE_NAMES
     NODE_NAMES[func.__name__] = func
@@ -108,12 +234,20 @@ def memoized_node(func: Callable[..., np.ndarray]):
     def wrapper(*args):
         node = args[0]
         key = (func.__name__, *args[1:])
+
+        def create():
+            image = func(*args)
+            assert image is not None
+            return node.child(image, key)
+
+        if isinstance(node.children, ChildCache):
+            return node.children.get_or_create(key, create)
+        if node.children is None:
+            node.children = {}
         val = node.children.get(key)
         if val is not None:
             return val
-        image = func(*args)
-        assert image is not None
-        child = Node(image, parents=[node], key=key)
+        child = create()
         node.children[key] = child
         return child
 
@@ -0,0 +1,192 @@
+"""
+A forward pass for our small sequential keras models, written in plain numpy so that running them doesn't need
+tensorflow at all. The weights are read straight out of the `.h5` file.
+
+Only the layers our own models use are supported: Reshape, Conv2D, AveragePooling2D, Flatten, BatchNormalization,
+Dense and Dropout. Each BatchNormalization is folded into the Dense layer after it, since they're both affine.
+"""
+
+import json
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+
+class UnsupportedModel(Exception):
+    pass
+
+
+ACTIVATIONS = {
+    None: lambda x: x,
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0, out=x),
+    'softmax': lambda x: _softmax(x),
+}
+
+
+def _softmax(x: np.ndarray) -> np.ndarray:
+    x = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    return x / np.sum(x, axis=-1, keepdims=True)
+
+
+def _activation(config) -> Callable[[np.ndarray], np.ndarray]:
+    name = config.get('activation')
+    if name not in ACTIVATIONS:
+        raise UnsupportedModel(f'unsupported activation "{name}"')
+    return ACTIVATIONS[name]
+
+
+def _conv2d(config, kernel: np.ndarray, bias: Optional[np.ndarray]):
+    if config.get('padding', 'valid') != 'valid' or tuple(config.get('dilation_rate', (1, 1))) != (1, 1):
+        raise UnsupportedModel('only undilated convolutions with valid padding are supported')
+    stride_y, stride_x = config.get('strides', (1, 1))
+    kernel_height, kernel_width, channels, filters = kernel.shape
+    # Our windows come out as (kernel_height, kernel_width, channels), so match the kernel to that
+    flat_kernel = kernel.reshape(kernel_height * kernel_width * channels, filters)
+    activation = _activation(config)
+
+    def conv2d(x):
+        # A view of every window as (n, height, width, ky, kx, channels). This is built by hand with `as_strided`,
+        # since `sliding_window_view` needs a newer numpy than the one we're locked to
+        n, in_height, in_width, _ = x.shape
+        height = (in_height - kernel_height) // stride_y + 1
+        width = (in_width - kernel_width) // stride_x + 1
+        step_n, step_y, step_x, step_c = x.strides
+        windows = np.lib.stride_tricks.as_strided(
+            x, (n, height, width, kernel_height, kernel_width, channels),
+            (step_n, step_y * stride_y, step_x * stride_x, step_y, step_x, step_c), writeable=False)
+        # im2col: (n, height, width, ky, kx, channels) -> (n * height * width, ky * kx * channels)
+        columns = windows.reshape(n * height * width, -1)
+        out = columns @ flat_kernel
+        if bias is not None:
+            out += bias
+        return activation(out.reshape(n, height, width, filters))
+
+    return conv2d
+
+
+def _average_pooling2d(config):
+    pool_y, pool_x = config.get('pool_size', (2, 2))
+    strides = config.get('strides') or (pool_y, pool_x)
+    if tuple(strides) != (pool_y, pool_x) or config.get('padding', 'valid') != 'valid':
+        raise UnsupportedModel('only non-overlapping pooling with valid padding is supported')
+
+    def average_pooling2d(x):
+        n, height, width, channels = x.shape
+        height, width = height // pool_y, width // pool_x
+        x = x[:, :height * pool_y, :width * pool_x]
+        return x.reshape(n, height, pool_y, width, pool_x, channels).mean(axis=(2, 4))
+
+    return average_pooling2d
+
+
+def _dense(config, kernel: np.ndarray, bias: Optional[np.ndarray]):
+    activation = _activation(config)
+
+    def dense(x):
+        out = x @ kernel
+        if bias is not None:
+            out += bias
+        return activation(out)
+
+    return dense
+
+
+def _batch_normalization_affine(config, weights) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the scale and shift that batch normalization applies at inference time."""
+    axis = config.get('axis', -1)
+    if axis not in (-1, [-1]):
+        raise UnsupportedModel('only batch normalization over the last axis is supported')
+    mean = weights['moving_mean']
+    variance = weights['moving_variance']
+    gamma = weights.get('gamma', np.ones_like(mean))
+    beta = weights.get('beta', np.zeros_like(mean))
+    scale = gamma / np.sqrt(variance + config.get('epsilon', 1e-3))
+    return scale, beta - mean * scale
+
+
+def _read_layers(path: str):
+    """Yields each layer's class name, config and weights by name (kernel, bias, gamma, ...)."""
+    import h5py
+    with h5py.File(path, 'r') as f:
+        config = json.loads(f.attrs['model_config'])
+        if config['class_name'] != 'Sequential':
+            raise UnsupportedModel(f'only Sequential models are supported, not {config["class_name"]}')
+
+        model_weights = f['model_weights'] if 'model_weights' in f else f
+        for layer in config['config']['layers']:
+            class_name = layer['class_name']
+            layer_config = layer['config']
+            weights = {}
+            name = layer_config['name']
+            if name in model_weights:
+                group = model_weights[name]
+                for weight_name in group.attrs.get('weight_names', []):
+                    if isinstance(weight_name, bytes):
+                        weight_name = weight_name.decode('utf8')
+                    short_name = weight_name.split('/')[-1].split(':')[0]
+                    weights[short_name] = np.array(group[weight_name], dtype=np.float32)
+            yield class_name, layer_config, weights
+
+
+class NumpyModel:
+    """
+    Runs a sequential keras model with numpy. Calling it with a batch returns the model's predictions, just like
+    calling the keras model would.
+    """
+
+    def __init__(self, path: str):
+        self.layers: List[Callable[[np.ndarray], np.ndarray]] = []
+
+        # The scale and shift of a batch normalization, waiting to be folded into the next layer
+        pending: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+        for class_name, config, weights in _read_layers(path):
+            if class_name in ('InputLayer', 'Dropout'):
+                continue
+
+            if class_name == 'BatchNormalization':
+                scale, shift = _batch_normalization_affine(config, weights)
+                if pending is not None:
+                    scale, shift = pending[0] * scale, pending[1] * scale + shift
+                pending = (scale, shift)
+                continue
+
+            if class_name == 'Dense':
+                kernel = weights['kernel']
+                bias = weights.get('bias')
+                if pending is not None:
+                    # dense(x * scale + shift) == x @ (scale * kernel) + (shift @ kernel + bias)
+                    scale, shift = pending
+                    bias = (0 if bias is None else bias) + shift @ kernel
+                    kernel = scale[:, np.newaxis] * kernel
+                    pending = None
+                self.layers.append(_dense(config, kernel, bias))
+                continue
+
+            if pending is not None:
+                scale, shift = pending
+                self.layers.append(lambda x, scale=scale, shift=shift: x * scale + shift)
+                pending = None
+
+            if class_name == 'Reshape':
+                target_shape = tuple(config['target_shape'])
+                self.layers.append(lambda x, target_shape=target_shape: x.reshape((x.shape[0], *target_shape)))
+            elif class_name == 'Conv2D':
+                self.layers.append(_conv2d(config, weights['kernel'], weights.get('bias')))
+            elif class_name == 'AveragePooling2D':
+                self.layers.append(_average_pooling2d(config))
+            elif class_name == 'Flatten':
+                self.layers.append(lambda x: x.reshape(x.shape[0], -1))
+            else:
+                raise UnsupportedModel(f'unsupported layer {class_name}')
+
+        if pending is not None:
+            scale, shift = pending
+            self.layers.append(lambda x: x * scale + shift)
+
+    def __call__(self, batch) -> np.ndarray:
+        x = np.asarray(batch, dtype=np.float32)
+        for layer in self.layers:
+            x = layer(x)
+        return x
@@ -1 +1 @@
-from .model import ObjectModel, ObjectPrediction, train_object_model
+from .model import ObjectModel, ObjectPrediction, SkipUnchangedTiles, train_object_model
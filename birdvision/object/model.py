@@ -5,26 +5,37 @@ The strategies I've tried so far aren't really working well at all. I want somet
 the architectures I've tried so far aren't there.
 """
 
+import functools
 import os
 import random
+from collections import deque
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable, List, Tuple
+from typing import Iterable, List, Optional, Tuple
 
 import cv2
 import numpy as np
 
 from birdvision.constants import STREAM_WIDTH, STREAM_HEIGHT
-from birdvision.node import Node
+from birdvision.inference import load_engine
+from birdvision.node import ChildCache, Node
 from birdvision.rectangle import Rectangle
+from birdvision.stats import HitRate
 
 TILE_WIDTH = 45
 TILE_HEIGHT = 37
 SCALE = 2
+# How many cells wide and high each tile's fingerprint is, see `tile_fingerprints`
+FINGERPRINT_CELLS = (5, 4)
 
 
 def load_classes() -> List[str]:
-    root = Path(os.environ['OBJECTS_SRC'])
+    return _load_classes(os.environ['OBJECTS_SRC'])
+
+
+@functools.lru_cache
+def _load_classes(src: str) -> List[str]:
+    root = Path(src)
     classes = ['None']
     for path in root.iterdir():
         if path.is_dir():
@@ -32,17 +43,42 @@ def load_classes() -> List[str]:
     return sorted(classes)
 
 
-def node_to_tiles(frame: Node) -> Iterable[Node]:
-    load_classes()
-    width, height = frame.width, frame.height
-    tiles_wide = width // TILE_WIDTH
-    tiles_high = height // TILE_HEIGHT
-    for i in range(tiles_wide):
-        for j in range(tiles_high):
-            x_offset = i * TILE_WIDTH
-            y_offset = j * TILE_HEIGHT
-            rect = Rectangle(i * TILE_WIDTH, j * TILE_HEIGHT, TILE_WIDTH, TILE_HEIGHT)
-            yield x_offset, y_offset, frame.crop(rect)
+def tile_rects(width: int, height: int) -> List[Rectangle]:
+    """Every whole tile in an image of this size, column by column from the left."""
+    return [Rectangle(i * TILE_WIDTH, j * TILE_HEIGHT, TILE_WIDTH, TILE_HEIGHT)
+            for i in range(width // TILE_WIDTH)
+            for j in range(height // TILE_HEIGHT)]
+
+
+def image_to_tiles(image: np.ndarray) -> np.ndarray:
+    """
+    Cuts the image into a `(tiles, TILE_HEIGHT, TILE_WIDTH, channels)` array, in the same order as `tile_rects`. The
+    tiles are views into the image reshaped by strides, so the only copy made is the one that lines them up.
+    """
+    tiles_high = image.shape[0] // TILE_HEIGHT
+    tiles_wide = image.shape[1] // TILE_WIDTH
+    whole = image[:tiles_high * TILE_HEIGHT, :tiles_wide * TILE_WIDTH]
+    tiles = whole.reshape(tiles_high, TILE_HEIGHT, tiles_wide, TILE_WIDTH, -1).transpose(2, 0, 1, 3, 4)
+    return tiles.reshape(tiles_wide * tiles_high, TILE_HEIGHT, TILE_WIDTH, -1)
+
+
+def downscale(frame: Node) -> Node:
+    return frame.resize(STREAM_WIDTH // SCALE, STREAM_HEIGHT // SCALE)
+
+
+def tile_fingerprints(small: Node) -> np.ndarray:
+    """
+    A `(tiles, cells)` array of each tile's fingerprint, in the same order as `tile_rects`. Like `frame_fingerprint`,
+    each cell is the mean of a patch of the grayscale tile, so compression noise averages out but a sprite moving
+    doesn't.
+    """
+    cells_wide, cells_high = FINGERPRINT_CELLS
+    tiles_high = small.height // TILE_HEIGHT
+    tiles_wide = small.width // TILE_WIDTH
+    whole = small.gray.image[:tiles_high * TILE_HEIGHT, :tiles_wide * TILE_WIDTH]
+    cells = cv2.resize(whole, (tiles_wide * cells_wide, tiles_high * cells_high), interpolation=cv2.INTER_AREA)
+    cells = cells.reshape(tiles_high, cells_high, tiles_wide, cells_wide).transpose(2, 0, 1, 3)
+    return cells.reshape(tiles_wide * tiles_high, cells_high * cells_wide).astype(np.int16)
 
 
 @dataclass(frozen=True)
@@ -60,30 +96,80 @@ class ObjectModel:
     """
 
     def __init__(self):
-        import tensorflow as tf
         self.classes = load_classes()
-        self.model = tf.keras.models.load_model(os.environ['OBJECT_MODEL'])
+        self.model = load_engine(os.environ['OBJECT_MODEL'])
 
     def __call__(self, frame: Node) -> List[ObjectPrediction]:
-        import tensorflow as tf
-        tiles = list(node_to_tiles(frame.resize(STREAM_WIDTH // SCALE, STREAM_HEIGHT // SCALE)))
-        y_pred = self.model(tf.stack([process_image(tile.image) for (_, _, tile) in tiles]))
+        small = downscale(frame)
+        tiles = image_to_tiles(small.image)
+        return self.predictions(small, tiles, self.model(process_image(tiles)))
 
+    def predictions(self, small: Node, tiles: np.ndarray, y_pred: np.ndarray) -> List[ObjectPrediction]:
+        """Pairs each tile of the downscaled frame with what the model predicted for it."""
         pred_class = [self.classes[i] for i in np.argmax(y_pred, axis=1)]
         confidence = np.max(y_pred, axis=1)
 
         out = []
-        for i in range(len(tiles)):
-            x_offset, y_offset, tile = tiles[i]
-            rect = Rectangle(x_offset * SCALE, y_offset * SCALE, TILE_WIDTH, TILE_HEIGHT)
+        for i, tile_rect in enumerate(tile_rects(small.width, small.height)):
+            tile = small.child(tiles[i], key=('crop', tile_rect))
+            rect = Rectangle(tile_rect.x * SCALE, tile_rect.y * SCALE, TILE_WIDTH, TILE_HEIGHT)
             out.append(ObjectPrediction(pred_class[i], confidence[i], rect, tile))
         return out
 
 
+class SkipUnchangedTiles(HitRate):
+    """
+    Sits in front of an `ObjectModel`, and only classifies the tiles that have changed since they were last classified,
+    along with the tiles around them, since a sprite moving out of one tile moves into its neighbour. Every other tile
+    reuses its last prediction, which during normal gameplay is nearly all of them.
+
+    A tile has changed when any cell of its fingerprint differs by more than `threshold` from its fingerprint when it
+    was last classified, so a slow fade still gets caught eventually. Each reused tile counts as a hit, and each one
+    classified again as a miss.
+    """
+
+    def __init__(self, model: ObjectModel, threshold: int = 8):
+        self.model = model
+        self.threshold = threshold
+        self.fingerprints: Optional[np.ndarray] = None
+        self.y_pred: Optional[np.ndarray] = None
+        self.hits = 0
+        self.misses = 0
+
+    def changed_tiles(self, fingerprints: np.ndarray, tiles_wide: int) -> np.ndarray:
+        """The index of every tile to classify again, in the same order as `tile_rects`."""
+        if self.fingerprints is None or self.fingerprints.shape != fingerprints.shape:
+            return np.arange(len(fingerprints))
+        changed = np.max(np.abs(fingerprints - self.fingerprints), axis=1) > self.threshold
+        # Tiles are column by column, so the grid of them is tiles_wide rows of tiles_high
+        grid = changed.reshape(tiles_wide, -1).astype(np.uint8)
+        return np.flatnonzero(cv2.dilate(grid, np.ones((3, 3), dtype=np.uint8)))
+
+    def __call__(self, frame: Node) -> List[ObjectPrediction]:
+        small = downscale(frame)
+        tiles = image_to_tiles(small.image)
+        fingerprints = tile_fingerprints(small)
+        changed = self.changed_tiles(fingerprints, small.width // TILE_WIDTH)
+
+        if len(changed) == len(tiles):
+            self.y_pred = np.array(self.model.model(process_image(tiles)))
+            self.fingerprints = fingerprints
+        elif len(changed):
+            self.y_pred[changed] = self.model.model(process_image(tiles[changed]))
+            self.fingerprints[changed] = fingerprints[changed]
+
+        self.hits += len(tiles) - len(changed)
+        self.misses += len(changed)
+        return self.model.predictions(small, tiles, self.y_pred)
+
+
 def load_relevant_sprites() -> Iterable[Tuple[str, Node]]:
+    from birdvision.loader import read_images
     root = Path(os.environ['OBJECTS_SRC'])
-    for path in root.glob('**/*.png'):
-        img = cv2.imread(path.as_posix())
+    paths = list(root.glob('**/*.png'))
+    for path, img in zip(paths, read_images(paths)):
+        if img is None:
+            continue
         node = Node(img)
         if node.width < 24 or node.height < 24:
             continue
@@ -97,7 +183,8 @@ def load_relevant_backgrounds() -> Iterable[Node]:
     root = Path(os.environ['GENERATIVE_BGS_SRC'])
     for path in root.glob('*.png'):
         img = cv2.imread(path.as_posix())
-        node = Node(img)
+        # These live for all of training, so keep their memoized children bounded
+        node = Node(img, children=ChildCache(max_size=4, thread_safe=False))
         yield node.resize(node.width // 2, node.height // 2)
 
 
@@ -109,13 +196,31 @@ def blit(dest: np.ndarray, src: np.ndarray, loc: Tuple[int, int]):
     target[tuple((slice(None, i) for i in src.shape))] = src
 
 
-def alpha_blit(dest: np.ndarray, src: np.ndarray, loc: Tuple[int, int]):
-    dest_like = np.zeros(dest.shape, dtype=np.uint8)
-    blit(dest_like, src, loc)
-    not_obj = dest_like == 0
+def _blit_overlap(offset: int, dest_size: int, src_size: int) -> Tuple[slice, slice]:
+    """
+    Along one axis, the slice of `dest` that `blit` writes to, and the slice of `src` it copies there. Like `blit`, only
+    the first `dest_size` rows or columns of `src` are ever copied, even when it's offset up or to the left.
+    """
+    dest_start = offset if offset > 0 else 0
+    src_start = -offset if offset < 0 else 0
+    size = min(dest_size - dest_start, src_size) - src_start
+    if size < 0:
+        size = 0
+    return slice(dest_start, dest_start + size), slice(src_start, src_start + size)
 
-    np.multiply(dest, not_obj, out=dest)
-    np.add(dest, dest_like, out=dest)
+
+def alpha_blit(dest: np.ndarray, src: np.ndarray, loc: Tuple[int, int]):
+    """
+    Blits `src` onto `dest` in place, where each black channel of `src` is transparent. Only the region the two overlap
+    is touched.
+    """
+    dest_rows, src_rows = _blit_overlap(loc[0], dest.shape[0], src.shape[0])
+    dest_cols, src_cols = _blit_overlap(loc[1], dest.shape[1], src.shape[1])
+    region = dest[dest_rows, dest_cols]
+    src = src[src_rows, src_cols]
+    # Multiplying by the mask and adding is much faster than a copy with `where`, which isn't vectorized
+    np.multiply(region, src == 0, out=region)
+    np.add(region, src, out=region)
 
 
 def select_random_bg(backgrounds):
@@ -145,6 +250,7 @@ def add_random_sprite(dest, sprites):
 
 
 def process_image(image):
+    """Resizes and preprocesses an image for MobileNet, or a whole `(n, height, width, 3)` batch of them at once."""
     import tensorflow as tf
     import tensorflow.keras.applications.mobilenet as mn
     image = tf.image.resize(image, [128, 128])
@@ -152,27 +258,237 @@ def process_image(image):
     return image
 
 
-def generate_batches(batch_size=64, max_batches=20_000_000):
+def _pack(images: List[np.ndarray], padding: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Packs images of different sizes into one zero padded array, and returns it with each image's height and width.
+    Every image gets at least `padding` rows and columns of zeros after it.
+    """
+    sizes = np.array([image.shape[:2] for image in images])
+    packed = np.zeros((len(images), *(sizes.max(axis=0) + padding), 3), dtype=np.uint8)
+    for i, image in enumerate(images):
+        packed[i, :image.shape[0], :image.shape[1]] = image
+    return packed, sizes
+
+
+@dataclass
+class TrainingBank:
+    """
+    Every sprite and background that training samples are made from, each packed into one contiguous array, so a whole
+    batch of samples can be cut out of them with a few indexing operations. Sprites are padded with black, which
+    `alpha_blit` treats as transparent anyway, and every one has at least a row and column of it, for
+    `composite_sprites`.
+    """
+    sprites: np.ndarray
+    sprite_sizes: np.ndarray
+    sprite_labels: np.ndarray
+    backgrounds: np.ndarray
+    background_sizes: np.ndarray
+
+    FIELDS = ['sprites', 'sprite_sizes', 'sprite_labels', 'backgrounds', 'background_sizes']
+
+    @staticmethod
+    def from_sources() -> 'TrainingBank':
+        classes = load_classes()
+        kinds, sprites = zip(*[(kind, sprite.image) for kind, sprite in load_relevant_sprites()])
+        sprites, sprite_sizes = _pack(sprites, padding=1)
+        backgrounds, background_sizes = _pack([bg.image for bg in load_relevant_backgrounds()])
+        return TrainingBank(sprites, sprite_sizes, np.array([classes.index(kind) for kind in kinds]),
+                            backgrounds, background_sizes)
+
+    def save(self, root: Path):
+        for field in TrainingBank.FIELDS:
+            np.save(root / f'{field}.npy', getattr(self, field))
+
+    @staticmethod
+    def load(root: Path) -> 'TrainingBank':
+        """Memory maps a saved bank, so every process that loads it shares the same pages."""
+        return TrainingBank(*[np.load(root / f'{field}.npy', mmap_mode='r') for field in TrainingBank.FIELDS])
+
+
+def composite_sprites(tiles: np.ndarray, bank: TrainingBank, sprite: np.ndarray, offset_y: np.ndarray,
+                      offset_x: np.ndarray, flip: np.ndarray):
+    """
+    Draws bank sprite `sprite[i]`, flipped if `flip[i]` is set, over `tiles[i]` in place at the offset given, for every
+    tile at once, exactly as `alpha_blit` does for one. Each tile pixel gathers the sprite pixel that lands on it, or
+    black where none does, and then keeps its own value in every black channel.
+    """
+    rows = np.arange(tiles.shape[1])
+    cols = np.arange(tiles.shape[2])
+    sprite_height, sprite_width = bank.sprite_sizes[sprite].T
+    sprite_rows = rows - offset_y[:, np.newaxis]
+    sprite_cols = cols - offset_x[:, np.newaxis]
+    # `blit` only ever copies a sprite's first tile height rows and tile width columns, even when it's offset up or to
+    # the left, so the same goes here to make exactly the same samples
+    visible_height = np.minimum(sprite_height, tiles.shape[1])[:, np.newaxis]
+    visible_width = np.minimum(sprite_width, tiles.shape[2])[:, np.newaxis]
+    rows_inside = (sprite_rows >= 0) & (sprite_rows < visible_height)
+    cols_inside = (sprite_cols >= 0) & (sprite_cols < visible_width)
+    sprite_cols[flip] = sprite_width[flip, np.newaxis] - 1 - sprite_cols[flip]
+
+    # Tile pixels that no sprite pixel lands on take the black one in the sprite's last row and column of padding, and
+    # like backgrounds, pixels are taken by their flat index
+    _, max_height, max_width, channels = bank.sprites.shape
+    sprite_rows = np.where(rows_inside, sprite_rows, max_height - 1)
+    sprite_cols = np.where(cols_inside, sprite_cols, max_width - 1)
+    sprite_rows += sprite[:, np.newaxis] * max_height
+    index = sprite_rows[:, :, np.newaxis] * max_width + sprite_cols[:, np.newaxis, :]
+    pixels = np.take(bank.sprites.reshape(-1, channels), index, axis=0)
+
+    # Comparing the gathered pixels is cheaper than gathering a mask of them too
+    np.multiply(tiles, pixels == 0, out=tiles)
+    np.add(tiles, pixels, out=tiles)
+
+
+def generate_tiles(bank: TrainingBank, batch_size: int, none_idx: int,
+                   rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Makes a batch of `batch_size` training tiles, and the class of each one, the same way `select_random_bg` and
+    `add_random_sprite` make one sample, but for the whole batch at once. The first tile is a background alone, and the
+    second is black, both of the 'None' class.
+    """
+    rows = np.arange(TILE_HEIGHT)
+    cols = np.arange(TILE_WIDTH)
+
+    # A random crop of a random background, flipped half the time. Cropping at x from the flipped background is the
+    # same as cropping the mirrored columns from the original. Taking pixels by their flat index is several times faster
+    # than indexing with a separate array for each axis
+    bg = rng.integers(0, len(bank.backgrounds), batch_size)
+    bg_height, bg_width = bank.background_sizes[bg].T
+    x = rng.integers(0, bg_width - TILE_WIDTH + 1)
+    y = rng.integers(0, bg_height - TILE_HEIGHT + 1)
+    bg_cols = x[:, np.newaxis] + cols
+    flip = rng.random(batch_size) < 0.5
+    bg_cols[flip] = bg_width[flip, np.newaxis] - 1 - bg_cols[flip]
+    _, max_height, max_width, channels = bank.backgrounds.shape
+    bg_rows = (bg * max_height + y)[:, np.newaxis] + rows
+    index = bg_rows[:, :, np.newaxis] * max_width + bg_cols[:, np.newaxis, :]
+    tiles = np.take(bank.backgrounds.reshape(-1, channels), index, axis=0)
+    tiles[1] = 0
+
+    # A random sprite, flipped half the time, offset by up to half its size, and drawn over every tile but the first two
+    sprite = rng.integers(0, len(bank.sprites), batch_size)
+    sprite_height, sprite_width = bank.sprite_sizes[sprite].T
+    offset_y = rng.integers(-(sprite_height // 2), sprite_height // 2 + 1)
+    offset_x = rng.integers(-(sprite_width // 2), sprite_width // 2 + 1)
+    flip = rng.random(batch_size) < 0.5
+    composite_sprites(tiles[2:], bank, sprite[2:], offset_y[2:], offset_x[2:], flip[2:])
+
+    labels = bank.sprite_labels[sprite].copy()
+    labels[:2] = none_idx
+    return tiles, labels
+
+
+# The bank each worker process generates tiles from, see `_init_worker`
+_WORKER_BANK: Optional[TrainingBank] = None
+
+
+def _init_worker(root: Path):
+    global _WORKER_BANK
+    _WORKER_BANK = TrainingBank.load(root)
+
+
+def _worker_tiles(args) -> Tuple[np.ndarray, np.ndarray]:
+    batch_size, none_idx, seed = args
+    return generate_tiles(_WORKER_BANK, batch_size, none_idx, np.random.default_rng(seed))
+
+
+class TileWorkers:
+    """
+    A pool of processes that generate batches of training tiles, which each memory map the same saved copy of the bank.
+    There are `workers` of them, OBJECT_WORKERS or every core by default, and with none the tiles are generated in
+    this process instead. The pool lasts until `close`, so several `tf.data` pipelines can share it one after another.
+    """
+
+    def __init__(self, bank: TrainingBank, workers: Optional[int] = None):
+        import multiprocessing
+        import tempfile
+
+        if workers is None:
+            workers = int(os.environ.get('OBJECT_WORKERS', os.cpu_count()))
+        self.bank = bank
+        self.workers = workers
+        self.none_idx = load_classes().index('None')
+        self.tmp = None
+        self.pool = None
+        if workers:
+            self.tmp = tempfile.TemporaryDirectory()
+            bank.save(Path(self.tmp.name))
+            # Spawned for the same reason as `FramePipeline`'s workers
+            context = multiprocessing.get_context('spawn')
+            self.pool = context.Pool(workers, initializer=_init_worker, initargs=(Path(self.tmp.name),))
+
+    def batches(self, batch_size: int, max_batches: int) -> Iterable[Tuple[np.ndarray, np.ndarray]]:
+        """Yields batches of raw training tiles and their classes."""
+        # Each batch gets its own stream of random numbers, so it doesn't matter which process generates it
+        entropy = np.random.SeedSequence().entropy
+        seeds = ([i, entropy] for i in range(max_batches))
+        if self.pool is None:
+            for seed in seeds:
+                yield generate_tiles(self.bank, batch_size, self.none_idx, np.random.default_rng(seed))
+            return
+
+        # Only a few batches per worker are queued up ahead, rather than every batch there will ever be
+        pending = deque()
+        for seed in seeds:
+            pending.append(self.pool.apply_async(_worker_tiles, ((batch_size, self.none_idx, seed),)))
+            if len(pending) >= self.workers * 4:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+    def close(self):
+        """Stops the worker processes and deletes the saved bank. This can be called more than once."""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        if self.tmp is not None:
+            self.tmp.cleanup()
+            self.tmp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def generate_batches(workers: TileWorkers, batch_size=64, max_batches=20_000_000):
+    """
+    A `tf.data` pipeline of preprocessed training batches. The tiles are generated by `workers`, and resized and
+    preprocessed in parallel by tensorflow, with batches prefetched so the model never waits on them.
+    """
+    import tensorflow as tf
+
+    # `output_types` and `output_shapes` rather than `output_signature`, and the experimental AUTOTUNE, since
+    # tensorflow 2.3 doesn't have the newer names
+    dataset = tf.data.Dataset.from_generator(
+        lambda: workers.batches(batch_size, max_batches),
+        output_types=(tf.uint8, tf.int64),
+        output_shapes=(tf.TensorShape((batch_size, TILE_HEIGHT, TILE_WIDTH, 3)), tf.TensorShape((batch_size,))))
+    dataset = dataset.map(lambda xs, ys: (process_image(xs), ys), num_parallel_calls=tf.data.experimental.AUTOTUNE)
+    return dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+
+def samples_per_second(batch_size: int):
+    """A keras callback that prints how many training samples a second each epoch went through."""
+    import time
     import tensorflow as tf
-    classes = load_classes()
-    none_idx = classes.index('None')
-    sprites = list(load_relevant_sprites())
-    backgrounds = list(load_relevant_backgrounds())
+    started = {}
 
-    for i in range(max_batches):
-        just_bg = select_random_bg(backgrounds)
+    def on_epoch_end(epoch, logs):
+        seconds = time.perf_counter() - started['at']
+        print(f'epoch {epoch + 1}: {started["batches"] * batch_size / seconds:.1f} samples/s')
 
-        xs = [process_image(just_bg), process_image(np.zeros((TILE_HEIGHT, TILE_WIDTH, 3), dtype=np.uint8))]
-        ys = [none_idx, none_idx]
-        for j in range(batch_size - 2):
-            generated_tile = select_random_bg(backgrounds)
-            kind = add_random_sprite(generated_tile, sprites)
-            # cv2.imwrite(f'/Volumes/RAM_Disk/batch/{i}_{j}.png', generated_tile)
+    def on_epoch_begin(epoch, logs):
+        started['at'] = time.perf_counter()
+        started['batches'] = 0
 
-            xs.append(process_image(generated_tile))
-            ys.append(classes.index(kind))
+    def on_train_batch_end(batch, logs):
+        started['batches'] += 1
 
-        yield tf.stack(xs), np.array(ys)
+    return tf.keras.callbacks.LambdaCallback(on_epoch_begin=on_epoch_begin, on_epoch_end=on_epoch_end,
+                                             on_train_batch_end=on_train_batch_end)
 
 
 def train_object_model():
@@ -198,18 +514,24 @@ def train_object_model():
     early_stopping_cb = tf.keras.callbacks.EarlyStopping(
         patience=10, monitor='loss', restore_best_weights=True)
 
-    model.fit(generate_batches(), epochs=10, steps_per_epoch=200, callbacks=[early_stopping_cb])
-
-    for layer in base_model.layers:
-        layer.trainable = True
-
-    optimizer = tf.keras.optimizers.SGD(lr=0.01, momentum=0.9, decay=0.001)
-    model.compile(
-        optimizer=optimizer,
-        loss='sparse_categorical_crossentropy',
-        metrics=['accuracy'],
-    )
-
-    model.fit(generate_batches(), epochs=20, steps_per_epoch=200, callbacks=[early_stopping_cb])
+    batch_size = 64
+    # Both rounds of training share one pool of workers, which is shut down before the model is saved
+    with TileWorkers(TrainingBank.from_sources()) as workers:
+        batches = generate_batches(workers, batch_size)
+        model.fit(batches, epochs=10, steps_per_epoch=200,
+                  callbacks=[early_stopping_cb, samples_per_second(batch_size)])
+
+        for layer in base_model.layers:
+            layer.trainable = True
+
+        optimizer = tf.keras.optimizers.SGD(lr=0.01, momentum=0.9, decay=0.001)
+        model.compile(
+            optimizer=optimizer,
+            loss='sparse_categorical_crossentropy',
+            metrics=['accuracy'],
+        )
+
+        model.fit(batches, epochs=20, steps_per_epoch=200,
+                  callbacks=[early_stopping_cb, samples_per_second(batch_size)])
 
     model.save(dst)
@@ -0,0 +1,214 @@
+"""
+A multi-process pipeline for running the `Watcher` over frames faster than one process can.
+
+Each worker process loads its own models. Frames travel to the workers through a fixed set of shared memory slots, so
+only a slot's index is ever pickled, and a reorder stage hands the results back in the same order the frames went in.
+"""
+
+import multiprocessing
+import os
+import queue as q
+import time
+import traceback
+from collections import deque
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+from birdvision.stream import FRAME_SHAPE
+from birdvision.watcher import FrameInfo
+
+# How long to wait on workers before checking that they're all still alive
+WORKER_CHECK_SECONDS = 1.0
+
+
+@dataclass
+class PipelineMetrics:
+    submitted: int = 0
+    dropped: int = 0
+    completed: int = 0
+    queued_seconds: float = 0.0
+    watcher_seconds: float = 0.0
+    total_seconds: float = 0.0
+
+    def summary(self) -> str:
+        completed = max(self.completed, 1)
+        return (f'{self.submitted} submitted, {self.dropped} dropped, {self.completed} completed, '
+                f'queued {self.queued_seconds / completed * 1000:.1f}ms, '
+                f'watcher {self.watcher_seconds / completed * 1000:.1f}ms, '
+                f'total {self.total_seconds / completed * 1000:.1f}ms per frame')
+
+
+def _worker(slot_names: List[str], shape: Tuple[int, ...], tasks, results):
+    """
+    Runs the watcher over each task's frame, until it's sent None. If loading the watcher fails, or reading a frame
+    does, the traceback is sent back in place of a `FrameInfo`, to be raised in the parent.
+    """
+    memories = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    images = [np.ndarray(shape, dtype=np.uint8, buffer=memory.buf) for memory in memories]
+
+    try:
+        try:
+            import birdvision.quiet
+            from birdvision.inference import lazy_models
+            from birdvision.watcher import Watcher
+
+            birdvision.quiet.silence_tensorflow()
+            watcher = Watcher()
+            if not lazy_models():
+                watcher.warm_up()
+        except Exception:
+            results.put((None, None, None, traceback.format_exc(), 0.0, 0.0, 0.0))
+            return
+
+        while True:
+            task = tasks.get()
+            if task is None:
+                watcher.save_caches()
+                return
+            index, slot, submitted_at = task
+            started_at = time.monotonic()
+            try:
+                frame_info = watcher(watcher.frame(images[slot], lineage=False))
+                error = None
+            except Exception:
+                frame_info = None
+                error = traceback.format_exc()
+            results.put((index, slot, frame_info, error, submitted_at, started_at, time.monotonic()))
+    finally:
+        del images
+        for memory in memories:
+            memory.close()
+
+
+class FramePipeline:
+    """
+    Runs the `Watcher` over frames in a pool of worker processes. Frames go in with `submit`, and their `FrameInfo`s
+    come back out of `results` in the order they were submitted.
+
+    There are `slots` frames in flight at most. When they're all busy, `submit` either drops the frame or waits for a
+    slot to free up, which gives live streams and offline processing the backpressure they each want.
+
+    If a worker fails to load the watcher, fails on a frame, or dies, the next call that collects results raises an
+    exception. The pipeline should still be closed after that, which is always safe to do.
+    """
+
+    def __init__(self, workers: int = None, slots: int = None, shape=FRAME_SHAPE):
+        workers = workers or max(1, os.cpu_count() - 1)
+        slots = slots or workers * 2
+        self.shape = shape
+        self.closed = False
+        self.memories = []
+        self.processes = []
+
+        try:
+            nbytes = int(np.prod(shape))
+            self.memories = [shared_memory.SharedMemory(create=True, size=nbytes) for _ in range(slots)]
+            self.images = [np.ndarray(shape, dtype=np.uint8, buffer=memory.buf) for memory in self.memories]
+            self.free_slots = deque(range(slots))
+
+            # Workers are spawned rather than forked, since forking a process that has tensorflow's threads is unsafe
+            context = multiprocessing.get_context('spawn')
+            self.tasks = context.Queue()
+            self.done = context.Queue()
+            slot_names = [memory.name for memory in self.memories]
+            for _ in range(workers):
+                process = context.Process(target=_worker, args=(slot_names, shape, self.tasks, self.done), daemon=True)
+                process.start()
+                self.processes.append(process)
+        except BaseException:
+            self.close()
+            raise
+
+        self.next_index = 0
+        self.next_to_emit = 0
+        self.reorder = {}
+        self.metrics = PipelineMetrics()
+
+    def _collect(self, block: bool):
+        """
+        Moves finished frames into the reorder buffer, and frees their slots. While blocking, this checks every so often
+        that the workers are all still alive, rather than waiting forever on one that has died.
+        """
+        while True:
+            try:
+                result = self.done.get(block=block, timeout=WORKER_CHECK_SECONDS if block else None)
+            except q.Empty:
+                if not block:
+                    return
+                for process in self.processes:
+                    if not process.is_alive():
+                        raise Exception(f'pipeline worker {process.pid} died with exit code {process.exitcode}')
+                continue
+            block = False
+            index, slot, frame_info, error, submitted_at, started_at, finished_at = result
+            if slot is not None:
+                self.free_slots.append(slot)
+            if error is not None:
+                task = 'to load the watcher' if index is None else f'on frame {index}'
+                raise Exception(f'pipeline worker failed {task}:\n{error}')
+            self.reorder[index] = frame_info
+            self.metrics.completed += 1
+            self.metrics.queued_seconds += started_at - submitted_at
+            self.metrics.watcher_seconds += finished_at - started_at
+            self.metrics.total_seconds += time.monotonic() - submitted_at
+
+    def submit(self, image: np.ndarray, block: bool = False) -> bool:
+        """
+        Copies the frame into a free slot and queues it up for a worker. If every slot is busy, this drops the frame and
+        returns False, unless `block` is set, in which case it waits for a slot instead.
+        """
+        self._collect(block=False)
+        while block and not self.free_slots:
+            self._collect(block=True)
+        if not self.free_slots:
+            self.metrics.dropped += 1
+            return False
+
+        slot = self.free_slots.popleft()
+        self.images[slot][...] = image
+        self.tasks.put((self.next_index, slot, time.monotonic()))
+        self.next_index += 1
+        self.metrics.submitted += 1
+        return True
+
+    def results(self, block: bool = False) -> Iterable[FrameInfo]:
+        """
+        Yields every `FrameInfo` that's ready, in the order their frames were submitted. With `block` set, this waits
+        for every frame submitted so far instead.
+        """
+        self._collect(block=False)
+        while True:
+            if self.next_to_emit in self.reorder:
+                yield self.reorder.pop(self.next_to_emit)
+                self.next_to_emit += 1
+            elif block and self.next_to_emit < self.next_index:
+                self._collect(block=True)
+            else:
+                return
+
+    def close(self):
+        """Stops the workers and frees the shared memory. This can be called more than once, and after a failure."""
+        if self.closed:
+            return
+        self.closed = True
+        for process in self.processes:
+            if process.is_alive():
+                self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=WORKER_CHECK_SECONDS)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.images = []
+        for memory in self.memories:
+            memory.close()
+            memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
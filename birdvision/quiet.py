@@ -4,12 +4,18 @@ Utility module to contain any code for any external libraries that get too noisy
 
 
 def silence_tensorflow():
-    """Silence every warning of notice from tensorflow."""
-    import tensorflow as tf
+    """
+    Silence every warning of notice from tensorflow. This doesn't import tensorflow itself, which takes seconds, so
+    it's fine to call even if tensorflow is never used. Everything is configured through the environment and the
+    `tensorflow` logger, which tensorflow picks up whenever it does get imported.
+    """
     import logging
     import os
+    import sys
     logging.getLogger('tensorflow').setLevel(logging.ERROR)
     os.environ["KMP_AFFINITY"] = "noverbose"
     os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
-    tf.get_logger().setLevel('ERROR')
-    tf.autograph.set_verbosity(3)
+    os.environ['AUTOGRAPH_VERBOSITY'] = '3'
+
+    if 'tensorflow' in sys.modules:
+        sys.modules['tensorflow'].autograph.set_verbosity(3)
@@ -0,0 +1,650 @@
+"""
+This program times the hot paths of the watcher, so that an optimization can be measured against the code it replaces.
+"""
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import click
+import cv2
+
+import birdvision.quiet
+from birdvision.config import configure
+from birdvision.node import Node
+from birdvision.rectangle import Rectangle
+
+
+def load_test_frames():
+    test_cases = json.loads(Path('data/tests/character.json').read_text())
+    return [cv2.imread('data/tests/character/' + fp) for fp in test_cases]
+
+
+def time_per_frame(images, f, repeat: int) -> float:
+    """Returns the mean number of seconds `f` takes per image, after a warm up pass. Every call gets a fresh Node."""
+    for image in images:
+        f(Node(image))
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for image in images:
+            f(Node(image))
+    return (time.perf_counter() - start) / (repeat * len(images))
+
+
+def check_parity(mismatches: int, total: int, what: str):
+    """Prints how many of `total` results differ from the code they replace, and fails if any of them do."""
+    print(f'{mismatches} mismatched {what} out of {total}')
+    if mismatches:
+        sys.exit(1)
+
+
+def report(name: str, seconds: float, baseline: float = None):
+    line = f'{name:>24}: {seconds * 1000:8.2f}ms'
+    if baseline is not None:
+        line += f' ({baseline / seconds:.2f}x)'
+    print(line)
+
+
+@click.group()
+def benchmark():
+    pass
+
+
+@benchmark.command()
+@click.option('--repeat', default=5, help='How many times to go over the test frames')
+def finders(repeat):
+    """Reading both unit panels with one model call per finder, or one batched call per font."""
+    from birdvision.character import CharacterModel, read_strings
+    from birdvision.watcher import UnitVitalsReader, UnitNameReader
+
+    char_model = CharacterModel()
+    all_finders = UnitVitalsReader(char_model).finders + UnitNameReader(char_model).finders
+    for finder in all_finders:
+        finder.cache = None
+    images = load_test_frames()
+
+    def per_finder(frame):
+        return [finder(frame) for finder in all_finders]
+
+    def batched(frame):
+        return read_strings(all_finders, frame)
+
+    mismatches = 0
+    for image in images:
+        expected = [s.to_str() for s in per_finder(Node(image))]
+        actual = [s.to_str() for s in batched(Node(image))]
+        mismatches += sum(a != b for a, b in zip(expected, actual))
+    check_parity(mismatches, len(images) * len(all_finders), 'strings')
+
+    baseline = time_per_frame(images, per_finder, repeat)
+    report('per finder', baseline)
+    report('batched', time_per_frame(images, batched, repeat), baseline)
+
+
+def read_video(path: str, limit: int):
+    capture = cv2.VideoCapture(path)
+    try:
+        for _ in range(limit):
+            ok, image = capture.read()
+            if not ok:
+                return
+            yield image
+    finally:
+        capture.release()
+
+
+@benchmark.command()
+@click.option('--threshold', default=8, help='The fingerprint difference that counts as a changed frame')
+@click.option('--limit', default=15 * 60 * 60, help='The maximum number of frames to read')
+@click.argument('video')
+def skip_cache(video, threshold, limit):
+    """Running the watcher over a recording of the stream, with and without skipping unchanged frames."""
+    from birdvision.character import cache_hit_rates
+    from birdvision.watcher import SkipUnchangedFrames, Watcher
+
+    watcher = Watcher()
+    cached = SkipUnchangedFrames(watcher, threshold=threshold)
+
+    uncached_time = 0.0
+    cached_time = 0.0
+    mismatches = 0
+    frames = 0
+    for image in read_video(video, limit):
+        start = time.perf_counter()
+        expected = watcher(Node(image))
+        uncached_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = cached(Node(image))
+        cached_time += time.perf_counter() - start
+
+        mismatches += actual != expected
+        frames += 1
+
+    print(f'{frames} frames, {cached.hits} hits, {cached.misses} misses ({cached.hit_rate:.1%} hit rate)')
+    print(f'{mismatches} frames where the cached FrameInfo differs')
+    report('uncached', uncached_time)
+    report('skip unchanged', cached_time, uncached_time)
+
+    print('string cache hit rates:')
+    for name, hit_rate in cache_hit_rates(watcher.finders).items():
+        print(f'{name:>24}: {hit_rate:.1%}')
+
+
+def time_per_call(f, batch, repeat: int) -> float:
+    f(batch)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        f(batch)
+    return (time.perf_counter() - start) / repeat
+
+
+@benchmark.command()
+@click.option('--repeat', default=100, help='How many calls to time for each batch size')
+def engines(repeat):
+    """Calling each model eagerly through keras, compared to each inference engine."""
+    import numpy as np
+    import tensorflow as tf
+    from birdvision.inference import KerasEngine, TFLiteEngine, tflite_path
+    from birdvision.numpy_model import NumpyModel, UnsupportedModel
+
+    for variable in ['SMALL_DIGIT_MODEL', 'ALPHA_NUM_MODEL', 'STREAM_STATE_MODEL', 'OBJECT_MODEL']:
+        model_path = os.environ[variable]
+        model = tf.keras.models.load_model(model_path)
+        candidates = [('keras', KerasEngine(model_path))]
+        if tflite_path(model_path).exists():
+            candidates.append(('tflite', TFLiteEngine(tflite_path(model_path))))
+        try:
+            candidates.append(('numpy', NumpyModel(model_path)))
+        except UnsupportedModel:
+            pass
+
+        for batch_size in [1, 9, 32]:
+            print(f'{variable}, batch of {batch_size}:')
+            batch = np.random.random_sample((batch_size, *model.input_shape[1:])).astype(np.float32)
+            baseline = time_per_call(model, batch, repeat)
+            report('eager', baseline)
+            for name, engine in candidates:
+                report(name, time_per_call(engine, batch, repeat), baseline)
+
+
+@benchmark.command()
+@click.option('--frames', default=600, help='How many frames of the test source to read')
+def stream(frames):
+    """Reading frames out of ffmpeg as MJPEG and decoding them, compared to reading raw frames into a ring buffer."""
+    import subprocess
+    import numpy as np
+    from birdvision.constants import STREAM_WIDTH, STREAM_HEIGHT
+    from birdvision.stream import RawFrameReader, raw_frames_command, read_mjpeg_frames
+
+    # A local test pattern the size of the cropped stream, generated as fast as ffmpeg can go
+    test_source = ['-f', 'lavfi', '-i', f'testsrc=size={STREAM_WIDTH}x{STREAM_HEIGHT}:rate=1000',
+                   '-frames:v', str(frames)]
+
+    start = time.perf_counter()
+    mjpeg_command = ['ffmpeg', '-loglevel', 'panic', *test_source, '-q:v', '2', '-f', 'mpjpeg', 'pipe:1']
+    with subprocess.Popen(mjpeg_command, stdout=subprocess.PIPE, bufsize=1024 * 1024 * 2) as proc:
+        mjpeg_count = 0
+        for jpeg in read_mjpeg_frames(proc.stdout):
+            cv2.imdecode(np.frombuffer(jpeg, np.uint8), flags=cv2.IMREAD_COLOR)
+            mjpeg_count += 1
+    mjpeg_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with subprocess.Popen(raw_frames_command(test_source, video_filter=None), stdout=subprocess.PIPE,
+                          bufsize=0) as proc:
+        reader = RawFrameReader(proc.stdout, ring_size=4)
+        raw_count = 0
+        while reader.read() is not None:
+            reader.advance()
+            raw_count += 1
+    raw_time = time.perf_counter() - start
+
+    print(f'mjpeg: {mjpeg_count / mjpeg_time:8.1f} frames/s')
+    print(f'  raw: {raw_count / raw_time:8.1f} frames/s ({mjpeg_time / mjpeg_count / (raw_time / raw_count):.2f}x)')
+
+
+@benchmark.command()
+@click.option('--repeat', default=5, help='How many times to go over the test frames')
+@click.option('--max-workers', default=os.cpu_count(), help='The largest number of worker processes to try')
+def pipeline(repeat, max_workers):
+    """Running the watcher in one process, compared to a pipeline of worker processes."""
+    from birdvision.pipeline import FramePipeline, PipelineMetrics
+    from birdvision.watcher import Watcher
+
+    images = load_test_frames()
+    frames = len(images) * repeat
+
+    watcher = Watcher()
+    baseline = time_per_frame(images, watcher, repeat)
+    print(f'{"in process":>24}: {1 / baseline:8.1f} frames/s')
+
+    workers = 1
+    while workers <= max_workers:
+        with FramePipeline(workers=workers) as frame_pipeline:
+            # Warm the workers up, so that loading models isn't part of the timing
+            for image in images[:workers * 2]:
+                frame_pipeline.submit(image, block=True)
+            list(frame_pipeline.results(block=True))
+            frame_pipeline.metrics = PipelineMetrics()
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                for image in images:
+                    frame_pipeline.submit(image, block=True)
+                    list(frame_pipeline.results())
+            list(frame_pipeline.results(block=True))
+            seconds = time.perf_counter() - start
+
+            print(f'{f"{workers} workers":>24}: {frames / seconds:8.1f} frames/s ({baseline * frames / seconds:.2f}x)')
+            print(f'{"":>24}  {frame_pipeline.metrics.summary()}')
+        workers *= 2
+
+
+@benchmark.command()
+@click.option('--repeat', default=5, help='How many times to go over the test frames')
+@click.option('--batch-size', default=64, help='How many frames to classify at once')
+def stream_state(repeat, batch_size):
+    """Classifying the stream state of one frame at a time, compared to a whole batch of frames at once."""
+    import numpy as np
+    from birdvision.stream_state.model import StreamStateModel, prepare_frame, prepare_frames
+
+    images = load_test_frames()
+    images = (images * (batch_size // len(images) + 1))[:batch_size]
+    model = StreamStateModel()
+    lineage_model = StreamStateModel(keep_lineage=True)
+
+    expected = np.array([prepare_frame(Node(image)).image for image in images])
+    mismatches = np.count_nonzero(np.any(prepare_frames(images) != expected, axis=(1, 2)))
+    check_parity(mismatches, len(images), 'prepared frames')
+
+    def per_frame(m):
+        return lambda batch: [m(Node(image)) for image in batch]
+
+    baseline = time_per_call(per_frame(lineage_model), images, repeat) / batch_size
+    report('per frame with nodes', baseline)
+    report('per frame', time_per_call(per_frame(model), images, repeat) / batch_size, baseline)
+    report('batched nodes', time_per_call(lambda batch: model.classify_batch([Node(image) for image in batch]),
+                                          images, repeat) / batch_size, baseline)
+    report('batched frames', time_per_call(model.classify_batch, images, repeat) / batch_size, baseline)
+    stacked = np.stack(images)
+    report('batched array', time_per_call(model.classify_batch, stacked, repeat) / batch_size, baseline)
+
+
+@benchmark.command()
+@click.option('--repeat', default=20, help='How many times to go over the test frames')
+def prepare_frame(repeat):
+    """Preparing a frame for the stream state model through the node graph, compared to without any nodes."""
+    import numpy as np
+    from birdvision.stream_state import model
+
+    images = load_test_frames()
+    mismatches = sum(not np.array_equal(model.prepare_frame(Node(image)).image, model.prepare_frame_fast(Node(image)))
+                     for image in images)
+    check_parity(mismatches, len(images), 'prepared frames')
+
+    out = np.empty((64, 64), dtype=np.uint8)
+    baseline = time_per_frame(images, model.prepare_frame, repeat)
+    report('nodes', baseline)
+    report('fast', time_per_frame(images, model.prepare_frame_fast, repeat), baseline)
+    report('fast into a buffer', time_per_frame(images, lambda frame: model.prepare_frame_fast(frame, out), repeat),
+           baseline)
+
+
+@benchmark.command()
+@click.option('--repeat', default=5, help='How many times to go over the test frames')
+def lineage(repeat):
+    """Running the watcher over frames that keep their lineage, compared to frames that don't."""
+    import tracemalloc
+    import numpy as np
+    from birdvision.node import set_keep_lineage
+    from birdvision.watcher import Watcher
+
+    watcher = Watcher()
+    for finder in watcher.finders:
+        finder.cache = None
+    images = load_test_frames()
+
+    baseline = None
+    for name, keep in [('with lineage', True), ('without lineage', False)]:
+        set_keep_lineage(keep)
+        seconds = time_per_frame(images, watcher, repeat)
+        report(name, seconds, baseline)
+        baseline = baseline or seconds
+
+        # What the frame's node graph holds onto once the watcher is done with it, other than the images themselves
+        tracemalloc.start()
+        not_numpy = [tracemalloc.DomainFilter(inclusive=False, domain=np.lib.tracemalloc_domain)]
+        blocks = 0
+        size = 0
+        for image in images:
+            before = tracemalloc.take_snapshot().filter_traces(not_numpy)
+            frame = Node(image)
+            watcher(frame)
+            stats = tracemalloc.take_snapshot().filter_traces(not_numpy).compare_to(before, 'filename')
+            blocks += sum(stat.count_diff for stat in stats)
+            size += sum(stat.size_diff for stat in stats)
+            del frame
+        tracemalloc.stop()
+        print(f'{"":>24}  {blocks / len(images):.0f} blocks, {size / len(images) / 1024:.1f}KiB allocated per frame')
+    set_keep_lineage(True)
+
+
+@benchmark.command()
+@click.option('--repeat', default=5, help='How many times to go over the test frames')
+@click.option('--max-threads', default=os.cpu_count(), help='The largest number of finder threads to try')
+def finder_threads(repeat, max_threads):
+    """Reading both unit panels of a frame with its finders segmented in one thread, compared to a pool of them."""
+    from birdvision.stream_state import GAME_SELECT_FULL
+    from birdvision.stream_state.model import StreamState
+    from birdvision.watcher import Watcher
+
+    images = load_test_frames()
+    state = StreamState(GAME_SELECT_FULL, 1.0, None)
+
+    def time_watcher(threads: int) -> float:
+        watcher = Watcher(threads=threads)
+        for finder in watcher.finders:
+            finder.cache = None
+        return time_per_frame(images, lambda frame: watcher.read(watcher.frame(frame.image), state), repeat)
+
+    baseline = time_watcher(0)
+    report('no threads', baseline)
+    threads = 1
+    while threads <= max_threads:
+        report(f'{threads} threads', time_watcher(threads), baseline)
+        threads *= 2
+
+
+def find_character_rects_with_loops(img):
+    """The original, loop by loop way of finding one finder's characters, to check the numpy version against."""
+    import numpy as np
+
+    contours, _ = cv2.findContours(img.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    rects = [cv2.boundingRect(ctr) for ctr in contours]
+
+    # Filter out rects that are too small or large to be letters
+    filtered_rects = []
+    for (x, y, w, h) in rects:
+        if w < 5 or h < 9:
+            continue
+        if w > 40 or h > 40:
+            continue
+        filtered_rects.append((x, y, w, h))
+
+    # Stop early if no letters/numbers
+    if not filtered_rects:
+        return []
+
+    median_x = np.median([rect[0] for rect in filtered_rects])
+    rects_with_distance = [(abs(median_x - x), x, y, w, h) for (x, y, w, h) in filtered_rects]
+
+    # Sort rects by distance from median, so closest is first
+    rects_with_distance.sort(key=lambda rect: rect[0])
+
+    filtered_rects = []
+    prev_dist = rects_with_distance[0][0]
+    for (dist, x, y, w, h) in rects_with_distance:
+        if dist - prev_dist > 25:
+            break
+        prev_dist = dist
+        filtered_rects.append((x, y, w, h))
+
+    # Sort from left-right
+    filtered_rects.sort(key=lambda rect: rect[0])
+
+    out = []
+
+    # Find the minimum y so all letters can start there
+    min_y = min([rect[1] for rect in filtered_rects])
+
+    for (x, y, w, h) in filtered_rects:
+        # Adjust our bounds so that all rects start at min_y
+        diff_y = min_y - y
+        y = int(min_y)
+        h -= int(diff_y)
+
+        # Reject rects too tall after the extension
+        if h > 40:
+            continue
+        out.append(Rectangle(max(x - 1, 0), max(y - 1, 0), w + 2, h + 2))
+
+    return out
+
+
+@benchmark.command()
+@click.option('--repeat', default=5, help='How many times to go over the test frames')
+def segmentation(repeat):
+    """Finding characters one finder at a time with loops, compared to all of a frame's finders at once with numpy."""
+    from birdvision.character import finder, read_strings
+    from birdvision.watcher import Watcher
+
+    finders = Watcher().finders
+    for string_finder in finders:
+        string_finder.cache = None
+    images = load_test_frames()
+    prepared = [[f.prepare_fn(Node(image), f.rect).image for f in finders] for image in images]
+
+    def with_loops(frames):
+        return [[find_character_rects_with_loops(img) for img in frame] for frame in frames]
+
+    def with_numpy(frames):
+        return [finder._find_character_rects_batch([finder._contour_rects(img) for img in frame]) for frame in frames]
+
+    mismatches = sum(expected != actual
+                     for expected_frame, actual_frame in zip(with_loops(prepared), with_numpy(prepared))
+                     for expected, actual in zip(expected_frame, actual_frame))
+    check_parity(mismatches, len(images) * len(finders), 'finders')
+
+    baseline = time_per_call(with_loops, prepared, repeat) / len(images)
+    report('loops', baseline)
+    report('numpy', time_per_call(with_numpy, prepared, repeat) / len(images), baseline)
+    report('reading every finder', time_per_frame(images, lambda frame: read_strings(finders, frame), repeat))
+
+
+@benchmark.command()
+@click.option('--repeat', default=5, help='How many times to go over the test frames')
+def glyph_index(repeat):
+    """Reading small digits with the model alone, compared to looking them up in the labelled glyphs first."""
+    from birdvision.character import CharacterModel, finders_from_model
+    from birdvision.character.model import SMALL_DIGIT_CHARSET, GlyphIndex
+
+    char_model = CharacterModel()
+    index = char_model.small_digit_index
+    print(f'{len(index.table)} labelled glyphs')
+    images = load_test_frames()
+    finders = [finder for finder in finders_from_model(char_model) if finder.reader_fn == char_model.read_small_digits]
+    characters = [[crop.image for finder in finders for crop in finder.segment(Node(image)).crops] for image in images]
+
+    def model_only(frames):
+        char_model.small_digit_index = GlyphIndex(SMALL_DIGIT_CHARSET, max_learned=0)
+        return [char_model.read_small_digits(chars)[0] for chars in frames]
+
+    def indexed(frames):
+        char_model.small_digit_index = index
+        return [char_model.read_small_digits(chars)[0] for chars in frames]
+
+    expected = model_only(characters)
+    actual = indexed(characters)
+    mismatches = sum(a != b for frame_a, frame_b in zip(expected, actual) for a, b in zip(frame_a, frame_b))
+    print(f'{mismatches} mismatched digits out of {sum(map(len, characters))}, '
+          f'{index.hit_rate:.1%} found in the index')
+
+    baseline = time_per_call(model_only, characters, repeat) / len(images)
+    report('model only', baseline)
+    report('glyph index', time_per_call(indexed, characters, repeat) / len(images), baseline)
+    print(f'{index.learned} glyphs learned')
+
+
+@benchmark.command()
+@click.option('--repeat', default=5, help='How many times to go over the test frames')
+def object_tiles(repeat):
+    """Cropping and preprocessing the object model's tiles one at a time, compared to all of them at once."""
+    import numpy as np
+    import tensorflow as tf
+    from birdvision.constants import STREAM_WIDTH, STREAM_HEIGHT
+    from birdvision.object.model import SCALE, TILE_WIDTH, TILE_HEIGHT, image_to_tiles, process_image
+
+    images = load_test_frames()
+
+    def one_at_a_time(frame):
+        small = frame.resize(STREAM_WIDTH // SCALE, STREAM_HEIGHT // SCALE)
+        rects = [Rectangle(i * TILE_WIDTH, j * TILE_HEIGHT, TILE_WIDTH, TILE_HEIGHT)
+                 for i in range(small.width // TILE_WIDTH) for j in range(small.height // TILE_HEIGHT)]
+        return tf.stack([process_image(small.crop(rect).image) for rect in rects]).numpy()
+
+    def batched(frame):
+        small = frame.resize(STREAM_WIDTH // SCALE, STREAM_HEIGHT // SCALE)
+        return process_image(image_to_tiles(small.image)).numpy()
+
+    mismatches = sum(not np.array_equal(one_at_a_time(Node(image)), batched(Node(image))) for image in images)
+    check_parity(mismatches, len(images), 'frames')
+
+    baseline = time_per_frame(images, one_at_a_time, repeat)
+    report('one at a time', baseline)
+    report('batched', time_per_frame(images, batched, repeat), baseline)
+
+
+@benchmark.command()
+@click.option('--threshold', default=8, help='The fingerprint difference that counts as a changed tile')
+@click.option('--limit', default=15 * 60, help='The maximum number of frames to read')
+@click.argument('video')
+def object_tiles_changed(video, threshold, limit):
+    """Running the object model over a recording of the stream, with and without skipping unchanged tiles."""
+    from birdvision.object import ObjectModel, SkipUnchangedTiles
+
+    model = ObjectModel()
+    skipping = SkipUnchangedTiles(model, threshold=threshold)
+
+    every_tile_time = 0.0
+    skipping_time = 0.0
+    mismatches = 0
+    tiles = 0
+    for image in read_video(video, limit):
+        start = time.perf_counter()
+        expected = model(Node(image))
+        every_tile_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = skipping(Node(image))
+        skipping_time += time.perf_counter() - start
+
+        mismatches += sum(a.kind != b.kind for a, b in zip(expected, actual))
+        tiles += len(expected)
+
+    print(f'{skipping.misses} tiles classified, {skipping.hits} reused ({skipping.hit_rate:.1%})')
+    print(f'{mismatches} tiles out of {tiles} where the reused prediction differs')
+    report('every tile', every_tile_time)
+    report('changed tiles', skipping_time, every_tile_time)
+
+
+@benchmark.command()
+@click.option('--batches', default=200, help='How many batches of 64 samples to generate each way')
+@click.option('--max-workers', default=os.cpu_count(), help='The largest number of worker processes to try')
+def object_batches(batches, max_workers):
+    """Generating object model training samples one at a time, compared to the tf.data pipeline."""
+    import numpy as np
+    import tensorflow as tf
+    from birdvision.object.model import TileWorkers, TrainingBank, add_random_sprite, generate_batches, load_classes, \
+        load_relevant_backgrounds, load_relevant_sprites, process_image, select_random_bg
+
+    batch_size = 64
+    classes = load_classes()
+    sprites = list(load_relevant_sprites())
+    backgrounds = list(load_relevant_backgrounds())
+
+    def samples_per_second(make_batches) -> float:
+        start = time.perf_counter()
+        for xs, ys in make_batches():
+            assert len(xs) == len(ys) == batch_size
+        return batches * batch_size / (time.perf_counter() - start)
+
+    def one_at_a_time():
+        for _ in range(batches):
+            xs, ys = [], []
+            for _ in range(batch_size):
+                tile = select_random_bg(backgrounds)
+                ys.append(classes.index(add_random_sprite(tile, sprites)))
+                xs.append(process_image(tile))
+            yield tf.stack(xs), np.array(ys)
+
+    print(f'{"one at a time":>24}: {samples_per_second(one_at_a_time):8.1f} samples/s')
+    bank = TrainingBank.from_sources()
+    workers = 0
+    while workers <= max_workers:
+        with TileWorkers(bank, workers) as tile_workers:
+            dataset = generate_batches(tile_workers, batch_size, batches)
+            print(f'{f"{workers} workers":>24}: {samples_per_second(lambda: dataset):8.1f} samples/s')
+        workers = workers * 2 if workers else 1
+
+
+def alpha_blit_onto_black_copy(dest, src, loc):
+    """The original way of alpha blitting, onto a whole black copy of `dest`, to check the in place versions against."""
+    import numpy as np
+    from birdvision.object.model import blit
+
+    dest_like = np.zeros(dest.shape, dtype=np.uint8)
+    blit(dest_like, src, loc)
+    not_obj = dest_like == 0
+
+    np.multiply(dest, not_obj, out=dest)
+    np.add(dest, dest_like, out=dest)
+
+
+@benchmark.command()
+@click.option('--repeat', default=50, help='How many batches to composite each way')
+@click.option('--batch-size', default=64, help='How many sprites to composite in each batch')
+def alpha_blit(repeat, batch_size):
+    """
+    Compositing sprites over tiles one at a time onto a black copy of each tile, compared to in place, and batched. The
+    one at a time ways are handed each sprite already cut out of the bank and flipped, the batched way does that too.
+    """
+    import numpy as np
+    from birdvision.object.model import TILE_WIDTH, TILE_HEIGHT, TrainingBank, composite_sprites
+    from birdvision.object.model import alpha_blit as in_place
+
+    bank = TrainingBank.from_sources()
+    rng = np.random.default_rng(0)
+    tiles = rng.integers(0, 256, (batch_size, TILE_HEIGHT, TILE_WIDTH, 3), dtype=np.uint8)
+    sprite = rng.integers(0, len(bank.sprites), batch_size)
+    sprite_height, sprite_width = bank.sprite_sizes[sprite].T
+    offset_y = rng.integers(-(sprite_height // 2), sprite_height // 2 + 1)
+    offset_x = rng.integers(-(sprite_width // 2), sprite_width // 2 + 1)
+    flip = rng.random(batch_size) < 0.5
+    images = [bank.sprites[i, :height, :width] for i, height, width in zip(sprite, sprite_height, sprite_width)]
+    images = [np.ascontiguousarray(image[:, ::-1] if flipped else image) for image, flipped in zip(images, flip)]
+
+    def one_at_a_time(blit):
+        def f(batch):
+            batch = batch.copy()
+            for tile, image, y, x in zip(batch, images, offset_y, offset_x):
+                blit(tile, image, (y, x))
+            return batch
+        return f
+
+    def batched(batch):
+        batch = batch.copy()
+        composite_sprites(batch, bank, sprite, offset_y, offset_x, flip)
+        return batch
+
+    ways = {
+        'reference': one_at_a_time(alpha_blit_onto_black_copy),
+        'in place': one_at_a_time(in_place),
+        'batched': batched,
+    }
+    expected = ways['reference'](tiles)
+    faster = [f for name, f in ways.items() if name != 'reference']
+    mismatches = sum(not np.array_equal(a, b) for f in faster for a, b in zip(expected, f(tiles)))
+    check_parity(mismatches, batch_size * len(faster), 'tiles')
+
+    seconds = {name: time_per_call(f, tiles, repeat) for name, f in ways.items()}
+    for name in ways:
+        report(name, seconds[name], seconds['reference'])
+
+
+if __name__ == '__main__':
+    configure()
+    birdvision.quiet.silence_tensorflow()
+    benchmark()
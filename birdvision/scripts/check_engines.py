@@ -0,0 +1,65 @@
+"""
+This program checks that every inference engine agrees with keras itself, over all of our labelled data.
+"""
+import os
+import sys
+
+import click
+import numpy as np
+
+import birdvision.quiet
+from birdvision.config import configure
+from birdvision.inference import TFLiteEngine, has_fresh_export, tflite_path
+from birdvision.numpy_model import NumpyModel
+
+TOLERANCE = 1e-4
+
+
+def labelled_inputs():
+    from birdvision.character.model import _load_labelled_characters, SMALL_DIGIT_CHARSET, ALPHA_NUM_CHARSET
+    from birdvision.stream_state.model import load_labelled_states
+
+    xs, _ = _load_labelled_characters(os.environ['SMALL_DIGIT_SRC'], SMALL_DIGIT_CHARSET)
+    yield os.environ['SMALL_DIGIT_MODEL'], xs / 255.0
+    xs, _ = _load_labelled_characters(os.environ['ALPHA_NUM_SRC'], ALPHA_NUM_CHARSET)
+    yield os.environ['ALPHA_NUM_MODEL'], xs / 255.0
+    xs, _ = load_labelled_states()
+    yield os.environ['STREAM_STATE_MODEL'], xs / 255.0
+
+
+def predict(model, xs, batch_size):
+    return np.concatenate([model(xs[i:i + batch_size]) for i in range(0, len(xs), batch_size)])
+
+
+@click.command()
+@click.option('--batch-size', default=256)
+def check_engines(batch_size):
+    import tensorflow as tf
+
+    failures = 0
+    for model_path, xs in labelled_inputs():
+        xs = xs.astype(np.float32)
+        keras_model = tf.keras.models.load_model(model_path)
+        expected = predict(lambda batch: keras_model(batch, training=False).numpy(), xs, batch_size)
+
+        engines = [('numpy', NumpyModel(model_path))]
+        if has_fresh_export(model_path):
+            engines.append(('tflite', TFLiteEngine(tflite_path(model_path))))
+
+        for name, engine in engines:
+            actual = predict(engine, xs, batch_size)
+            difference = np.max(np.abs(expected - actual))
+            disagreements = np.count_nonzero(np.argmax(expected, axis=1) != np.argmax(actual, axis=1))
+            ok = difference <= TOLERANCE and disagreements == 0
+            failures += not ok
+            print(f'{model_path} ({name}): {disagreements} disagreements over {len(xs)} images, '
+                  f'max difference {difference:.2e} {"ok" if ok else "FAILED"}')
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    configure()
+    birdvision.quiet.silence_tensorflow()
+    check_engines()
@@ -1,11 +1,14 @@
+import tempfile
 from pathlib import Path
 
 import click
 import cv2
+import numpy as np
 from sklearn.cluster import MiniBatchKMeans
 from tqdm import tqdm
 
 from birdvision.config import configure
+from birdvision.loader import imap_ordered, read_image, read_thumbnails
 from birdvision.node import Node
 
 
@@ -13,30 +16,12 @@ def chunk(seq, size):
     return (seq[pos:pos + size] for pos in range(0, len(seq), size))
 
 
-def load_image(path):
-    image = cv2.imread(path.as_posix())
-    if image is None or image.size == 0:
-        return None
-    return Node(image)
-
-
-def for_every_image(file_chunks, f):
-    for i, file_chunk in enumerate(tqdm(file_chunks, desc=f.__name__)):
-        images = []
-        for path in file_chunk:
-            image = load_image(path)
-            if image is None:
-                continue
-            images.append((path, image))
-
-        f(i, images)
-
-
-def images_for_cluster_type(images, cluster_type):
+def cluster_thumbnail(cluster_type):
+    """The function that turns an image into what gets clustered, a flattened 32x32 thumbnail."""
     if cluster_type == 'gray':
-        return [node.gray.thumbnail32.image.flatten() for (_, node) in images]
+        return lambda image: Node(image).gray.thumbnail32.image.flatten()
     elif cluster_type == 'color':
-        return [node.thumbnail32.image.flatten() for (_, node) in images]
+        return lambda image: Node(image).thumbnail32.image.flatten()
     else:
         raise Exception(f'unknown cluster_type option "{cluster_type}"')
 
@@ -61,37 +46,44 @@ def cluster_images(src, dst, clusters, cluster_type, output):
     dst = Path(dst)
 
     k_means = MiniBatchKMeans(n_clusters=clusters)
-    file_chunks = list(chunk(list(src.glob('**/*')), size=max(100, clusters * 5)))
-    predictions = []
-
-    def partial_fit(_i, images):
-        resized = images_for_cluster_type(images, cluster_type)
-        k_means.partial_fit(resized)
-
-    def predict(_i, images):
-        resized = images_for_cluster_type(images, cluster_type)
-        predictions.append(k_means.predict(resized))
-
-    def write_buckets(i, images):
-        for j, (path, node) in enumerate(images):
-            # FIXME: If images fail to load the second time but not the first, predictions[i][j] will be off.
-            bucket = predictions[i][j]
-            bucket_path = dst / str(bucket)
-            bucket_path.mkdir(parents=True, exist_ok=True)
-
-            image_path = (bucket_path / f'{i:05d}_{path.name}').as_posix()
-            if output == 'full':
-                cv2.imwrite(image_path, node.image)
-            elif output == 'gray':
-                cv2.imwrite(image_path, node.gray.image)
-            elif output == 'thumb':
-                cv2.imwrite(image_path, node.gray.thumbnail32.image)
-            else:
-                raise Exception(f'unknown output option "{output}"')
-
-    for_every_image(file_chunks, partial_fit)
-    for_every_image(file_chunks, predict)
-    for_every_image(file_chunks, write_buckets)
+    paths = list(src.glob('**/*'))
+    chunk_size = max(100, clusters * 5)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Every image is decoded and thumbnailed once, and both passes of k-means go over the thumbnails instead
+        thumbnails, paths = read_thumbnails(tqdm(paths, desc='thumbnails'), cluster_thumbnail(cluster_type),
+                                            Path(tmp) / 'thumbnails.npy')
+        if not paths:
+            print(f'no images could be read from {src}')
+            return
+        for thumbnail_chunk in tqdm(list(chunk(thumbnails, chunk_size)), desc='partial_fit'):
+            k_means.partial_fit(thumbnail_chunk)
+        predictions = np.concatenate([k_means.predict(thumbnail_chunk)
+                                      for thumbnail_chunk in tqdm(list(chunk(thumbnails, chunk_size)), desc='predict')])
+        del thumbnails
+
+    def write_bucket(row):
+        path = paths[row]
+        image = read_image(path)
+        if image is None:
+            return
+        node = Node(image)
+        bucket_path = dst / str(predictions[row])
+        bucket_path.mkdir(parents=True, exist_ok=True)
+
+        image_path = (bucket_path / f'{row // chunk_size:05d}_{path.name}').as_posix()
+        if output == 'full':
+            cv2.imwrite(image_path, node.image)
+        elif output == 'gray':
+            cv2.imwrite(image_path, node.gray.image)
+        elif output == 'thumb':
+            cv2.imwrite(image_path, node.gray.thumbnail32.image)
+        else:
+            raise Exception(f'unknown output option "{output}"')
+
+    # Decoding, converting and encoding each image all happen on the loader's threads
+    for _ in tqdm(imap_ordered(write_bucket, range(len(paths))), total=len(paths), desc='write_buckets'):
+        pass
 
 
 if __name__ == '__main__':
@@ -0,0 +1,45 @@
+"""
+This program compiles our keras models into `.tflite` files, and checks the compiled models agree with keras.
+"""
+import os
+import sys
+
+import click
+import numpy as np
+
+import birdvision.quiet
+from birdvision.config import configure
+from birdvision.inference import TFLiteEngine, export_tflite
+
+MODEL_VARIABLES = ['SMALL_DIGIT_MODEL', 'ALPHA_NUM_MODEL', 'STREAM_STATE_MODEL', 'OBJECT_MODEL']
+TOLERANCE = 1e-4
+
+
+@click.command()
+@click.option('--batch-size', default=16, help='How many random inputs to check each compiled model against')
+def export_models(batch_size):
+    import tensorflow as tf
+
+    failures = 0
+    for variable in MODEL_VARIABLES:
+        model_path = os.environ[variable]
+        compiled = export_tflite(model_path)
+
+        model = tf.keras.models.load_model(model_path)
+        batch = np.random.random_sample((batch_size, *model.input_shape[1:])).astype(np.float32)
+        expected = model(batch, training=False).numpy()
+        actual = TFLiteEngine(compiled)(batch)
+
+        difference = np.max(np.abs(expected - actual))
+        ok = difference <= TOLERANCE and np.array_equal(np.argmax(expected, axis=1), np.argmax(actual, axis=1))
+        failures += not ok
+        print(f'{compiled.as_posix()}: max difference {difference:.2e} {"ok" if ok else "FAILED"}')
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    configure()
+    birdvision.quiet.silence_tensorflow()
+    export_models()
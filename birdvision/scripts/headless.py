@@ -0,0 +1,92 @@
+"""
+This program watches the stream, or a recording of it, without any window, and writes out what it reads as a stream of
+JSON lines. Each line is one change in the `FrameInfo` read off of the frames.
+"""
+# Imported first, so that its clock starts as close to the start of the process as possible
+import birdvision.startup as startup
+
+import dataclasses
+import json
+import os
+import sys
+import threading
+import time
+from queue import Queue, Empty
+
+import click
+
+import birdvision.quiet
+from birdvision.character import cache_hit_rates
+from birdvision.config import configure
+from birdvision.inference import lazy_models
+from birdvision.stream import CROP_ARGUMENT, MAX_QUEUED_FRAMES, FrameProducer, get_stream_url, raw_frames_command
+from birdvision.watcher import SkipUnchangedFrames, Watcher
+
+
+def frame_event(frame_info, index: int, fps: int) -> dict:
+    return {
+        'time': time.time(),
+        'frame': index,
+        'offset': index / fps,
+        **dataclasses.asdict(frame_info),
+    }
+
+
+@click.command()
+@click.option('--video', help='Read a recorded video instead of the live stream')
+@click.option('--crop/--no-crop', default=True, help='Crop the game out of the full stream layout')
+@click.option('--output', type=click.File('w'), default='-', help='Where to write the JSON lines, stdout by default')
+@click.option('--queue-size', default=MAX_QUEUED_FRAMES, help='How many frames can wait to be read at once')
+@click.option('--block/--drop', default=None,
+              help='When the queue is full, stop reading until there is room, or drop frames. Recordings block by '
+                   'default, and the live stream drops.')
+def headless(video, crop, output, queue_size, block):
+    fps = int(os.environ['FPS'])
+    if block is None:
+        block = video is not None
+
+    input_url = video if video is not None else get_stream_url()
+    video_filter = f'fps={fps}'
+    if crop:
+        video_filter += ',' + CROP_ARGUMENT
+
+    with startup.phase('load models'):
+        watcher = Watcher()
+        if not lazy_models():
+            watcher.warm_up()
+        watcher = SkipUnchangedFrames(watcher, threshold=int(os.environ.get('FRAME_DIFF_THRESHOLD', 8)))
+    startup.report(file=sys.stderr)
+
+    stop_event = threading.Event()
+    queue = Queue(maxsize=queue_size)
+    producer = FrameProducer(raw_frames_command(['-i', input_url], video_filter), queue, stop_event, block=block)
+    threading.Thread(target=producer.run, daemon=True).start()
+
+    watched = 0
+    last_info = None
+    try:
+        while not (stop_event.is_set() and queue.empty()):
+            try:
+                index, image = queue.get(timeout=0.1)
+            except Empty:
+                continue
+
+            frame_info = watcher(watcher.frame(image, lineage=False))
+            if frame_info != last_info:
+                output.write(json.dumps(frame_event(frame_info, index, fps)) + '\n')
+                output.flush()
+                last_info = frame_info
+            watched += 1
+    finally:
+        stop_event.set()
+        print(f'{producer.frames} frames read, {producer.dropped} dropped, {watched} watched, '
+              f'{watcher.hit_rate:.1%} unchanged', file=sys.stderr)
+        for name, hit_rate in cache_hit_rates(watcher.watcher.finders).items():
+            print(f'{name:>8} cache: {hit_rate:.1%}', file=sys.stderr)
+        watcher.watcher.save_caches()
+
+
+if __name__ == '__main__':
+    configure()
+    birdvision.quiet.silence_tensorflow()
+    headless()
@@ -2,6 +2,9 @@
 This pygame application watches the stream live, displaying what it is reading off of each frame.
 """
 
+# Imported first, so that its clock starts as close to the start of the process as possible
+import birdvision.startup as startup
+
 import os
 import sys
 import threading
@@ -9,7 +12,6 @@ import time
 from queue import Queue, Empty
 
 import cv2
-import numpy as np
 import pygame
 
 import birdvision.quiet
@@ -17,8 +19,11 @@ import birdvision.stream as stream_viewer
 import birdvision.stream_state as stream_state
 from birdvision.config import configure
 from birdvision.constants import STREAM_WIDTH, STREAM_HEIGHT
+from birdvision.inference import lazy_models, preload_engines
 from birdvision.node import Node
-from birdvision.watcher import Watcher
+from birdvision.object import ObjectModel, SkipUnchangedTiles
+from birdvision.pipeline import FramePipeline
+from birdvision.watcher import SkipUnchangedFrames, Watcher
 
 
 def add_reading_rects(image, finder_rect, rects):
@@ -34,20 +39,40 @@ def main():
 
     stop_event = threading.Event()
 
-    queue = Queue(maxsize=fps * 30)
+    queue = Queue(maxsize=stream_viewer.MAX_QUEUED_FRAMES)
     ffmpeg_thread = threading.Thread(
         target=lambda: stream_viewer.download_stream(queue, stop_event),
         daemon=True)
     ffmpeg_thread.start()
 
-    pygame.init()
-    pygame.font.init()
-    font = pygame.font.Font('data/pygame/RobotoCondensed-Regular.ttf', 20)
-    pygame.display.set_caption("Birb Brains Vision")
-    pygame.display.set_icon(pygame.image.load('data/pygame/icon.png'))
-    size = width, height = STREAM_WIDTH, STREAM_HEIGHT + 200
-    screen = pygame.display.set_mode(size)
-    black = 0, 0, 0
+    with startup.phase('load models'):
+        workers = int(os.environ.get('WORKERS', 0))
+        if workers:
+            watcher = None
+            pipeline = FramePipeline(workers=workers)
+        else:
+            watcher = Watcher()
+            pipeline = None
+        object_model = None
+        if os.environ.get('OBJECT_DETECTION'):
+            object_model = SkipUnchangedTiles(ObjectModel(), threshold=int(os.environ.get('FRAME_DIFF_THRESHOLD', 8)))
+        if not lazy_models():
+            object_engines = [object_model.model.model] if object_model is not None else []
+            if watcher is not None:
+                watcher.warm_up(*object_engines)
+            else:
+                preload_engines(object_engines)
+        if watcher is not None:
+            watcher = SkipUnchangedFrames(watcher, threshold=int(os.environ.get('FRAME_DIFF_THRESHOLD', 8)))
+
+    with startup.phase('open window'):
+        pygame.init()
+        pygame.font.init()
+        font = pygame.font.Font('data/pygame/RobotoCondensed-Regular.ttf', 20)
+        pygame.display.set_caption("Birb Brains Vision")
+        pygame.display.set_icon(pygame.image.load('data/pygame/icon.png'))
+        size = width, height = STREAM_WIDTH, STREAM_HEIGHT + 200
+        screen = pygame.display.set_mode(size)
 
     surface = pygame.Surface((STREAM_WIDTH, STREAM_HEIGHT))
 
@@ -55,10 +80,24 @@ def main():
     #           + [(505, i * 28 + 5 + STREAM_HEIGHT) for i in range(6)]
 
     clock = pygame.time.Clock()
+    startup.report()
+
+    try:
+        run(stop_event, queue, fps, watcher, pipeline, object_model, screen, surface, font, clock)
+    finally:
+        if pipeline is not None:
+            print(pipeline.metrics.summary())
+            pipeline.close()
+        if watcher is not None:
+            watcher.watcher.save_caches()
+
+
+def run(stop_event, queue, fps, watcher, pipeline, object_model, screen, surface, font, clock):
+    width = screen.get_width()
+    black = 0, 0, 0
     saved_screens = 0
-    watcher = Watcher()
-    # object_model = ObjectModel()
     last_state = None
+    current_state = None
 
     while not stop_event.is_set():
         for event in pygame.event.get():
@@ -68,41 +107,47 @@ def main():
         f_start = time.monotonic()
 
         try:
-            image = queue.get(block=False)
+            _, image = queue.get(block=False)
         except Empty:
             clock.tick(fps)
             continue
 
-        jpeg_buf = np.frombuffer(image, np.uint8)
-        image = cv2.imdecode(jpeg_buf, flags=cv2.IMREAD_COLOR)
-        if image is None:
-            continue
-
-        frame = Node(image)
+        frame = Node(image, lineage=False) if watcher is None else watcher.frame(image, lineage=False)
         color_mapped = cv2.applyColorMap(frame.gray.image, cv2.COLORMAP_BONE)
 
-        frame_info = watcher(frame)
-        if frame_info != last_state and frame_info.state != stream_state.BLACK:
-            print(frame_info)
-            last_state = frame_info
+        if pipeline is None:
+            frame_infos = [watcher(frame)]
+        else:
+            pipeline.submit(image)
+            frame_infos = pipeline.results()
+
+        for frame_info in frame_infos:
+            current_state = frame_info.state
+            if frame_info != last_state and frame_info.state != stream_state.BLACK:
+                print(frame_info)
+                last_state = frame_info
 
         color_mapped = color_mapped[..., ::-1].copy()
         arr = pygame.surfarray.map_array(surface, color_mapped).swapaxes(0, 1)
         pygame.surfarray.blit_array(surface, arr)
         screen.blit(surface, surface.get_rect())
 
-        # if stream_state.in_game(frame_info.state):
-        #     objects = object_model(frame)
-        #     for obj in objects:
-        #         if obj.kind == 'None':
-        #             continue
-        #         kind = font.render(obj.kind, True, (100, 255, 100))
-        #         screen.blit(kind, obj.rect.top_left)
+        if object_model is not None and current_state is not None and stream_state.in_game(current_state):
+            objects = object_model(frame)
+            for obj in objects:
+                if obj.kind == 'None':
+                    continue
+                kind = font.render(obj.kind, True, (100, 255, 100))
+                screen.blit(kind, obj.rect.top_left)
 
         f_duration = time.monotonic() - f_start
         status_line = f'{queue.qsize():03d} {saved_screens:05d} {f_duration * 1000:.2f}ms'
+        if pipeline is None:
+            status_line += f' {watcher.hit_rate:.0%}'
+        else:
+            status_line += f' {pipeline.metrics.dropped} dropped'
         status_surf = font.render(status_line, True, (100, 255, 100))
-        screen.blit(status_surf, (width - 200, 25))
+        screen.blit(status_surf, (width - 250, 25))
 
         pygame.display.flip()
         screen.fill(black)
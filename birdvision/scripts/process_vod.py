@@ -0,0 +1,123 @@
+"""
+This program reprocesses a recording of the stream as fast as it can go, rather than in real time, for when a model
+has been updated. Stream states are classified a large batch of frames at a time, and only the frames in a state worth
+reading go through the character finders.
+
+The result is written as JSON lines, one for each change in `FrameInfo`, gzipped if the output ends with `.gz`.
+"""
+import dataclasses
+import gzip
+import json
+import os
+import queue as q
+import subprocess
+import threading
+import time
+from typing import Iterable, List, Tuple
+
+import click
+import numpy as np
+from tqdm import tqdm
+
+import birdvision.quiet
+from birdvision.config import configure
+from birdvision.stream import CROP_ARGUMENT, RawFrameReader, raw_frames_command
+from birdvision.watcher import Watcher
+
+
+def read_batches(command: List[str], batch_size: int) -> Iterable[Tuple[int, List[np.ndarray]]]:
+    """
+    Yields the index of each batch's first frame, and the batch itself. Frames are read from ffmpeg on another thread,
+    so that decoding the next batch overlaps with processing this one. Each batch is only valid until the next one is
+    asked for.
+    """
+    batches = q.Queue(maxsize=1)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            with subprocess.Popen(command, stdout=subprocess.PIPE, bufsize=0) as proc:
+                # One batch for the consumer to work on, one waiting in the queue, and one being read
+                reader = RawFrameReader(proc.stdout, ring_size=batch_size * 3)
+                start = 0
+                while not stop.is_set():
+                    batch = []
+                    while len(batch) < batch_size:
+                        frame = reader.read()
+                        if frame is None:
+                            break
+                        reader.advance()
+                        batch.append(frame)
+                    batches.put((start, batch))
+                    if len(batch) < batch_size:
+                        break
+                    start += len(batch)
+                proc.kill()
+        except Exception as e:
+            # Hand the error over, rather than leaving the consumer waiting forever for a batch
+            batches.put((None, e))
+            raise
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            start, batch = batches.get()
+            if isinstance(batch, Exception):
+                raise Exception('reading frames from ffmpeg failed') from batch
+            if batch:
+                yield start, batch
+            if len(batch) < batch_size:
+                return
+    finally:
+        stop.set()
+
+
+@click.command()
+@click.option('--crop/--no-crop', default=True, help='Crop the game out of the full stream layout')
+@click.option('--fps', type=int, help='How many frames a second to sample from the video, FPS by default')
+@click.option('--batch-size', default=64, help='How many frames to classify at once')
+@click.argument('video')
+@click.argument('output')
+def process_vod(video, output, crop, fps, batch_size):
+    fps = fps or int(os.environ['FPS'])
+    video_filter = f'fps={fps}'
+    if crop:
+        video_filter += ',' + CROP_ARGUMENT
+
+    watcher = Watcher()
+    watcher.warm_up()
+
+    frames = 0
+    changes = 0
+    last_info = None
+    start_time = time.perf_counter()
+    opener = gzip.open if output.endswith('.gz') else open
+    try:
+        with opener(output, 'wt') as out, tqdm(unit='frame') as progress:
+            for start, batch in read_batches(raw_frames_command(['-i', video], video_filter), batch_size):
+                states = watcher.stream_state_model.classify_batch(batch)
+                for i, (image, state) in enumerate(zip(batch, states)):
+                    frame_info = watcher.read(watcher.frame(image, lineage=False), state)
+                    if frame_info == last_info:
+                        continue
+                    index = start + i
+                    event = {'frame': index, 'offset': index / fps, **dataclasses.asdict(frame_info)}
+                    out.write(json.dumps(event) + '\n')
+                    last_info = frame_info
+                    changes += 1
+
+                frames += len(batch)
+                progress.update(len(batch))
+    finally:
+        watcher.save_caches()
+
+    seconds = time.perf_counter() - start_time
+    print(f'{frames} frames, {changes} changes in {seconds:.1f}s: {frames / seconds:.1f} frames/s, '
+          f'{frames / fps / seconds:.1f}x real time')
+
+
+if __name__ == '__main__':
+    configure()
+    birdvision.quiet.silence_tensorflow()
+    process_vod()
@@ -0,0 +1,42 @@
+"""
+Keeps track of how long each phase of starting up takes. A watcher that takes a long time to restart misses whatever
+happens on the stream in the meantime, so we want to know exactly where that time goes.
+"""
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Tuple
+
+STARTED_AT = time.perf_counter()
+PHASES: List[Tuple[str, float]] = []
+_lock = threading.Lock()
+
+
+@contextmanager
+def phase(name: str):
+    """Times everything inside the `with` block as one phase of starting up."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            PHASES.append((name, time.perf_counter() - start))
+
+
+def import_tensorflow():
+    """Imports tensorflow, timing it as its own phase the first time around."""
+    if 'tensorflow' in sys.modules:
+        return sys.modules['tensorflow']
+    with phase('import tensorflow'):
+        import tensorflow as tf
+    return tf
+
+
+def report(file=sys.stdout):
+    """Prints every phase so far, and how long it's been since this module was first imported."""
+    with _lock:
+        phases = list(PHASES)
+    for name, seconds in phases:
+        print(f'{name:>48}: {seconds * 1000:8.1f}ms', file=file)
+    print(f'{"total since start":>48}: {(time.perf_counter() - STARTED_AT) * 1000:8.1f}ms', file=file)
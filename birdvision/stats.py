@@ -0,0 +1,14 @@
+"""
+Counters shared by the caches that sit in front of the slow parts of reading a frame.
+"""
+
+
+class HitRate:
+    """Adds `hit_rate` to a class that counts its `hits` and `misses`."""
+    hits: int
+    misses: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
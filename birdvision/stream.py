@@ -5,10 +5,16 @@ This module contains functions for spawning processes to watch the Twitch stream
 import queue as q
 import subprocess
 import threading
+from typing import BinaryIO, Iterable, List, Optional
 
-from birdvision.constants import STREAM_RECT
+import numpy as np
+
+from birdvision.constants import STREAM_RECT, STREAM_WIDTH, STREAM_HEIGHT
 
 CROP_ARGUMENT = f'crop={STREAM_RECT.width}:{STREAM_RECT.height}:{STREAM_RECT.x}:{STREAM_RECT.y}'
+FRAME_SHAPE = (STREAM_HEIGHT, STREAM_WIDTH, 3)
+# The most frames a `FrameProducer`'s queue can hold. Raw frames are about 2MB each, so its ring stays around 70MB
+MAX_QUEUED_FRAMES = 30
 
 
 def get_stream_url():
@@ -18,32 +24,124 @@ def get_stream_url():
     return str(ok.stdout, encoding='utf-8')
 
 
+def raw_frames_command(input_args: List[str], video_filter: Optional[str] = CROP_ARGUMENT) -> List[str]:
+    """An ffmpeg command that writes every frame of its input to stdout as raw bgr24 pixels, with no header."""
+    command = ['ffmpeg', '-loglevel', 'panic', *input_args]
+    if video_filter is not None:
+        command += ['-filter:v', video_filter]
+    return command + ['-an', '-f', 'rawvideo', '-pix_fmt', 'bgr24', 'pipe:1']
+
+
+class RawFrameReader:
+    """
+    Reads raw bgr24 frames of a fixed shape straight into a ring of preallocated buffers, so reading a frame doesn't
+    allocate or copy anything.
+
+    `read` always fills the same buffer until `advance` is called, so a frame that gets dropped is simply overwritten
+    by the next one. A frame that has been advanced past stays valid until the ring comes back around to it, so the ring
+    has to be larger than the number of frames a consumer can hold onto at once.
+    """
+
+    def __init__(self, stream: BinaryIO, ring_size: int, shape=FRAME_SHAPE):
+        self.stream = stream
+        self.ring = np.empty((ring_size, *shape), dtype=np.uint8)
+        self.index = 0
+
+    def read(self) -> Optional[np.ndarray]:
+        """Fills the current buffer with the next frame and returns it, or returns None at the end of the stream."""
+        frame = self.ring[self.index]
+        view = memoryview(frame).cast('B')
+        filled = 0
+        while filled < len(view):
+            read = self.stream.readinto(view[filled:])
+            if not read:
+                return None
+            filled += read
+        return frame
+
+    def advance(self):
+        """Keep the frame that was just read, so the next frame goes into the next buffer along."""
+        self.index = (self.index + 1) % len(self.ring)
+
+
+def read_mjpeg_frames(stream: BinaryIO) -> Iterable[bytes]:
+    """Yields each JPEG in ffmpeg's `mpjpeg` output. This is how we used to read the stream, kept to compare against."""
+    length = 0
+    while True:
+        line = stream.readline()
+        if not line:
+            return
+        line = line.strip()
+        if line.startswith(b'--'):
+            continue
+        if line.startswith(b'Content-type:'):
+            assert line.endswith(b'image/jpeg')
+            continue
+        if line.startswith(b'Content-length:'):
+            length = int(line[len(b'Content-length: '):])
+            continue
+        if line == b'' and length:
+            yield stream.read(length)
+            length = 0
+
+
+class FrameProducer:
+    """
+    Runs an ffmpeg command from `raw_frames_command`, and puts each frame it outputs into a queue until `stop` is set or
+    ffmpeg runs out of frames, at which point it sets `stop` itself.
+
+    Each item in the queue is the frame's index in ffmpeg's output, and the frame as a `FRAME_SHAPE` array. The frame
+    stays valid while the consumer works on it, as long as the consumer only holds onto one frame at a time. When the
+    queue is full, the frame is either dropped, or with `block` set, we wait for room, which in turn stops reading
+    from ffmpeg until the consumer catches up. The queue can't hold more than `MAX_QUEUED_FRAMES`.
+    """
+
+    def __init__(self, command: List[str], queue: q.Queue, stop: threading.Event, block: bool = False):
+        if not 0 < queue.maxsize <= MAX_QUEUED_FRAMES:
+            raise Exception(f'queue of {queue.maxsize} frames, it has to hold between 1 and {MAX_QUEUED_FRAMES}')
+        self.command = command
+        self.queue = queue
+        self.stop = stop
+        self.block = block
+        self.frames = 0
+        self.dropped = 0
+
+    def _put(self, item) -> bool:
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, block=self.block, timeout=0.1 if self.block else None)
+                return True
+            except q.Full:
+                if not self.block:
+                    return False
+        return False
+
+    def run(self):
+        try:
+            with subprocess.Popen(self.command, stdout=subprocess.PIPE, bufsize=0) as proc:
+                # One more buffer for the frame the consumer is working on, and one more for the frame being read
+                reader = RawFrameReader(proc.stdout, ring_size=MAX_QUEUED_FRAMES + 2)
+                while not self.stop.is_set():
+                    frame = reader.read()
+                    if frame is None:
+                        break
+                    if self._put((self.frames, frame)):
+                        reader.advance()
+                    else:
+                        self.dropped += 1
+                    self.frames += 1
+                proc.kill()
+        finally:
+            self.stop.set()
+
+
 def download_stream(queue: q.Queue, stop: threading.Event):
     """Start watching twitch, this function blocks forever until `stop` is set or an error occurs in ffmpeg. It writes
-    each frame as raw bytes into the queue.
+    each frame into the queue, dropping frames when the queue is full. See `FrameProducer` for how long each frame
+    stays valid.
     """
     try:
         stream_url = get_stream_url()
-        with subprocess.Popen(['ffmpeg', '-loglevel', 'panic', '-i', stream_url, '-filter:v',
-                               CROP_ARGUMENT, '-q:v', '2', '-f',
-                               'mpjpeg', 'pipe:1'],
-                              stdout=subprocess.PIPE,
-                              bufsize=1024 * 1024 * 2) as proc:
-            length = 0
-            while not stop.is_set():
-                line = proc.stdout.readline().strip()
-                if line.startswith(b'--'):
-                    continue
-                if line.startswith(b'Content-type:'):
-                    assert line.endswith(b'image/jpeg')
-                    continue
-                if line.startswith(b'Content-length:'):
-                    length = int(line[len(b'Content-length: '):])
-                    continue
-                if line == b'':
-                    try:
-                        queue.put(proc.stdout.read(length), block=False)
-                    except q.Full:
-                        continue
+        FrameProducer(raw_frames_command(['-i', stream_url]), queue, stop).run()
     finally:
         stop.set()
@@ -2,11 +2,15 @@
 TODO: Module comment
 """
 
+import functools
 import os
 from dataclasses import dataclass
+from typing import List, Optional, Sequence, Union
 
+import cv2
 import numpy as np
 
+from birdvision.inference import load_engine
 from birdvision.node import Node
 from birdvision.rectangle import Rectangle
 
@@ -55,6 +59,11 @@ def unit_select(state: str) -> bool:
     return state.startswith('Game_Select')
 
 
+EFFECT_AREA = Rectangle(260, 94, 450, 95)
+BOTTOM_LEFT = Rectangle(40, 522, 470, 175)
+BOTTOM_RIGHT = Rectangle(520, 522, 470, 175)
+
+
 @dataclass
 class StreamState:
     name: str
@@ -70,36 +79,124 @@ class StreamStateModel:
     The character arrays mentioned are supposed to be 32x32 uint8 arrays that have already been preprocessed.
     """
 
-    def __init__(self):
-        import tensorflow as tf
-        self.model = tf.keras.models.load_model(os.environ['STREAM_STATE_MODEL'])
+    def __init__(self, keep_lineage: bool = False):
+        """
+        With `keep_lineage` set, each state's node is the one `prepare_frame` builds, with every crop and thumbnail
+        along the way, for the test viewer. Otherwise frames are prepared without any intermediate nodes.
+        """
+        self.model = load_engine(os.environ['STREAM_STATE_MODEL'])
+        self.keep_lineage = keep_lineage
 
     def __call__(self, frame: Node) -> StreamState:
-        prepared = prepare_frame(frame)
-        y_pred = self.model(np.array([prepared.image / 255.0]))
-        idx: int = np.argmax(y_pred, axis=1)[0]
-        certainty: float = np.max(y_pred, axis=1)
-        state = STREAM_STATES[idx]
-        return StreamState(state, certainty, prepared)
+        return self.classify_batch([frame])[0]
+
+    def classify_batch(self, frames: Union[Sequence[Node], Sequence[np.ndarray], np.ndarray]) -> List[StreamState]:
+        """
+        Classifies many frames with one call to the model, which is much faster than one call per frame.
+
+        `frames` is either a list of `Node`s, or a list or stacked array of BGR frames of the same size, which are all
+        prepared at once with `prepare_frames`. Each state's node is just its prepared image, unless `keep_lineage` is
+        set and the frames are nodes.
+        """
+        if len(frames) == 0:
+            return []
+        if isinstance(frames[0], Node) and self.keep_lineage:
+            prepared = [prepare_frame(frame) for frame in frames]
+            images = np.array([node.image for node in prepared])
+        else:
+            if isinstance(frames[0], Node):
+                frames = [frame.image for frame in frames]
+            images = prepare_frames(frames)
+            prepared = [Node(image) for image in images]
+
+        y_pred = self.model(images / 255.0)
+        indices = np.argmax(y_pred, axis=1)
+        certainties = np.max(y_pred, axis=1)
+        return [StreamState(STREAM_STATES[idx], float(certainty), node)
+                for idx, certainty, node in zip(indices, certainties, prepared)]
 
 
 def prepare_frame(frame: Node) -> Node:
     gray = frame.gray
 
     everything = gray.thumbnail32
-    bottom_left = gray.crop(Rectangle(40, 522, 470, 175)).thumbnail32
-    bottom_right = gray.crop(Rectangle(520, 522, 470, 175)).thumbnail32
-    effect_area = gray.crop(Rectangle(260, 94, 450, 95)).thumbnail32
+    bottom_left = gray.crop(BOTTOM_LEFT).thumbnail32
+    bottom_right = gray.crop(BOTTOM_RIGHT).thumbnail32
+    effect_area = gray.crop(EFFECT_AREA).thumbnail32
 
     image = np.block([[everything.image, effect_area.image], [bottom_left.image, bottom_right.image]])
-    return Node(image, parents=[everything, bottom_left, bottom_right, effect_area])
+    return Node(image, parents=[everything, bottom_left, bottom_right, effect_area], lineage=frame.lineage)
+
+
+def _resize_tiles(gray: np.ndarray, out: np.ndarray):
+    """Resizes each region of the gray frame straight into its quarter of the 64x64 `out`."""
+    cv2.resize(gray, (32, 32), dst=out[:32, :32])
+    cv2.resize(EFFECT_AREA.crop(gray), (32, 32), dst=out[:32, 32:])
+    cv2.resize(BOTTOM_LEFT.crop(gray), (32, 32), dst=out[32:, :32])
+    cv2.resize(BOTTOM_RIGHT.crop(gray), (32, 32), dst=out[32:, 32:])
+
+
+def prepare_frame_fast(frame: Node, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Returns the same pixels as `prepare_frame`, written into the 64x64 `out` if it's given, without creating a node
+    for each crop and thumbnail or stitching the tiles back together afterwards. See `prepare_frames`.
+    """
+    if out is None:
+        out = np.empty((64, 64), dtype=np.uint8)
+    prepare_frames([frame.image], out=out[np.newaxis])
+    return out
 
 
-def load_labelled_states():
+def _linear_taps(size: int, out: int) -> np.ndarray:
+    """The source indices a cv2.INTER_LINEAR resize from `size` down to `out` pixels reads along one axis."""
+    centers = (np.arange(out) + 0.5) * (size / out) - 0.5
+    left = np.floor(centers).astype(int)
+    return np.clip(np.concatenate([left, left + 1]), 0, size - 1)
+
+
+@functools.lru_cache(maxsize=None)
+def _sampled_rows(height: int, width: int) -> np.ndarray:
+    """The rows of a frame that the thumbnails in `prepare_frame` ever read."""
+    rows = [rect.y + _linear_taps(min(rect.bottom_y, height) - rect.y, 32)
+            for rect in [Rectangle(0, 0, width, height), EFFECT_AREA, BOTTOM_LEFT, BOTTOM_RIGHT]]
+    return np.unique(np.concatenate(rows))
+
+
+def prepare_frames(frames: Union[Sequence[np.ndarray], np.ndarray], out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Does what `prepare_frame` does to a whole batch of BGR frames of the same size at once, without any nodes, and
+    returns an (n, 64, 64) array with exactly the same pixels, which is `out` if it's given.
+
+    Shrinking a frame with linear interpolation only ever reads two rows for each row of output, so converting the
+    whole frame to gray is most of `prepare_frame`'s time. Instead, we gather the couple hundred rows the thumbnails
+    read from every frame in the batch, convert them all with one cvtColor, and fill in only those rows of the gray
+    frame before resizing it.
+    """
+    height, width = frames[0].shape[:2]
+    rows = _sampled_rows(height, width)
+    if isinstance(frames, np.ndarray):
+        sampled = frames.take(rows, axis=1)
+    else:
+        sampled = np.stack([frame.take(rows, axis=0) for frame in frames])
+    n = len(sampled)
+    sampled = cv2.cvtColor(sampled.reshape(n * len(rows), width, 3), cv2.COLOR_BGR2GRAY)
+    sampled = sampled.reshape(n, len(rows), width)
+
+    gray = np.zeros((height, width), dtype=np.uint8)
+    if out is None:
+        out = np.empty((n, 64, 64), dtype=np.uint8)
+    for i in range(n):
+        gray[rows] = sampled[i]
+        _resize_tiles(gray, out[i])
+    return out
+
+
+def load_labelled_states(batch_size: int = 64):
+    """Returns every labelled frame already prepared, as an (n, 64, 64) array, and the index of each one's state."""
     from pathlib import Path
-    import cv2
-    xs = []
-    ys = []
+    from birdvision.dataset import load_dataset
+    from birdvision.loader import read_images
+    files = []
 
     for path in Path(os.environ['STREAM_STATE_SRC']).iterdir():
         if path.name[0] == '.':
@@ -107,13 +204,17 @@ def load_labelled_states():
 
         state = path.name
         index = STREAM_STATES.index(state)
-        for image_path in path.glob('*.jpg'):
-            frame = Node(cv2.imread(image_path.as_posix()))
-            img = prepare_frame(frame)
-            xs.append(img)
-            ys.append(index)
+        files.extend((image_path, index) for image_path in path.glob('*.jpg'))
+
+    def load(paths):
+        xs = np.empty((len(paths), 64, 64), dtype=np.uint8)
+        images = read_images(paths)
+        for i in range(0, len(paths), batch_size):
+            frames = [next(images) for _ in paths[i:i + batch_size]]
+            prepare_frames(frames, out=xs[i:i + batch_size])
+        return xs
 
-    return np.array(xs), np.array(ys)
+    return load_dataset('stream_state', files, load)
 
 
 def train_stream_state():
@@ -149,7 +250,7 @@ def train_stream_state():
     )
 
     xs, ys = load_labelled_states()
-    xs = np.array([x.image for x in xs]) / 255.0
+    xs = xs / 255.0
     X_train, X_test, y_train, y_test = train_test_split(xs, ys, test_size=0.2)
 
     early_stopping_cb = tf.keras.callbacks.EarlyStopping(
@@ -7,19 +7,25 @@ import birdvision.stream_state as stream_state
 from birdvision.node import Node
 from birdvision.testing import TestResult
 
+BATCH_SIZE = 64
+
 
 def run():
     # TODO: Replace this with hand picked test cases instead of including everything
-    stream_state_model = stream_state.StreamStateModel()
+    stream_state_model = stream_state.StreamStateModel(keep_lineage=True)
 
     for path in Path(os.environ['STREAM_STATE_SRC']).iterdir():
         if path.name[0] == '.':
             continue
 
         expected = path.name
-        for image_path in path.glob('*.jpg'):
-            frame = Node(cv2.imread(image_path.as_posix()))
-            state = stream_state_model(frame)
-            actual = state.name
-            yield TestResult(image_path.as_posix(), name='stream_state', frame=frame, data=state,
-                             ok=actual == expected, actual=actual, expected=expected, relevant_nodes=[state.node])
+        image_paths = list(path.glob('*.jpg'))
+        for i in range(0, len(image_paths), BATCH_SIZE):
+            batch = image_paths[i:i + BATCH_SIZE]
+            frames = [Node(cv2.imread(image_path.as_posix())) for image_path in batch]
+            states = stream_state_model.classify_batch(frames)
+            for image_path, frame, state in zip(batch, frames, states):
+                actual = state.name
+                yield TestResult(image_path.as_posix(), name='stream_state', frame=frame, data=state,
+                                 ok=actual == expected, actual=actual, expected=expected,
+                                 relevant_nodes=[state.node])
@@ -1,16 +1,20 @@
 import os
+from concurrent.futures import Executor, ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional
 from uuid import uuid4
 
 import cv2
+import numpy as np
 
 from birdvision import stream_state
 from birdvision.character import CharacterModel
-from birdvision.character.finder import String, StringFinder, light_text, dark_text
-from birdvision.node import Node
+from birdvision.character.finder import String, StringFinder, light_text, dark_text, read_strings
+from birdvision.inference import preload_engines
+from birdvision.node import ChildCache, MemoStats, Node
 from birdvision.rectangle import Rectangle
+from birdvision.stats import HitRate
 from birdvision.stream_state import StreamStateModel
 from birdvision.stream_state.model import StreamState
 
@@ -42,6 +46,9 @@ class FrameInfo:
 
 LOW_CERTAINTY_CUT_OFF = 0.5
 
+# A tournament only has a few dozen units, and even fewer jobs, so their strings can all stay cached
+NAME_CACHE_SIZE = 256
+
 
 def write_low_certainty_node(path: str, node: Node):
     Path(path).mkdir(parents=True, exist_ok=True)
@@ -51,7 +58,8 @@ def write_low_certainty_node(path: str, node: Node):
 def record_low_certainty_string(tag: str, s: String):
     low_certainty_path = os.environ.get('RECORD_LOW_CERTAINTY')
     for i, confidence in enumerate(s.confidences):
-        if confidence > LOW_CERTAINTY_CUT_OFF:
+        # Strings loaded from a saved cache don't have their characters' nodes
+        if confidence > LOW_CERTAINTY_CUT_OFF or s.nodes[i] is None:
             continue
 
         if low_certainty_path is not None:
@@ -69,51 +77,63 @@ def record_low_certainty_stream_state(s: StreamState, frame: Node):
 class UnitVitalsReader:
     def __init__(self, character_model: CharacterModel):
         small_digit = character_model.read_small_digits
-        self.curHP = StringFinder('curHP', Rectangle(350, 588, 60, 27), prepare_fn=light_text, reader_fn=small_digit)
-        self.maxHP = StringFinder('maxHP', Rectangle(423, 601, 60, 27), prepare_fn=light_text, reader_fn=small_digit)
-        self.curMP = StringFinder('curMP', Rectangle(350, 623, 60, 27), prepare_fn=light_text, reader_fn=small_digit)
-        self.maxMP = StringFinder('maxMP', Rectangle(423, 636, 60, 27), prepare_fn=light_text, reader_fn=small_digit)
-        self.curCT = StringFinder('curCT', Rectangle(350, 658, 60, 27), prepare_fn=light_text, reader_fn=small_digit)
-
-    def __call__(self, frame: Node) -> UnitVitals:
-        curHP = self.curHP(frame)
-        maxHP = self.maxHP(frame)
-        curMP = self.curMP(frame)
-        maxMP = self.maxMP(frame)
-        curCT = self.curCT(frame)
-        record_low_certainty_string('curHP', curHP)
-        record_low_certainty_string('maxHP', maxHP)
-        record_low_certainty_string('curMP', curMP)
-        record_low_certainty_string('maxMP', maxMP)
-        record_low_certainty_string('curCT', curCT)
+        self.finders = [
+            StringFinder('curHP', Rectangle(350, 588, 60, 27), prepare_fn=light_text, reader_fn=small_digit),
+            StringFinder('maxHP', Rectangle(423, 601, 60, 27), prepare_fn=light_text, reader_fn=small_digit),
+            StringFinder('curMP', Rectangle(350, 623, 60, 27), prepare_fn=light_text, reader_fn=small_digit),
+            StringFinder('maxMP', Rectangle(423, 636, 60, 27), prepare_fn=light_text, reader_fn=small_digit),
+            StringFinder('curCT', Rectangle(350, 658, 60, 27), prepare_fn=light_text, reader_fn=small_digit),
+        ]
+
+    def __call__(self, frame: Node, executor: Optional[Executor] = None) -> UnitVitals:
+        return self.from_strings(read_strings(self.finders, frame, executor))
+
+    def from_strings(self, strings: List[String]) -> UnitVitals:
+        for finder, string in zip(self.finders, strings):
+            record_low_certainty_string(finder.name, string)
+        curHP, maxHP, curMP, maxMP, curCT = strings
         return UnitVitals(curHP.to_int(), maxHP.to_int(), curMP.to_int(), maxMP.to_int(), curCT.to_int())
 
 
+def string_cache_path(name: str) -> Optional[str]:
+    """Where the finder called `name` saves its cached strings, if STRING_CACHE is set."""
+    cache_dir = os.environ.get('STRING_CACHE')
+    return None if cache_dir is None else f'{cache_dir}/{name}.json'
+
+
 class UnitNameReader:
     def __init__(self, character_model: CharacterModel):
         small_digit = character_model.read_small_digits
         alpha_num = character_model.read_alpha_num
-        self.name = StringFinder('name', Rectangle(610, 545, 320, 40), prepare_fn=dark_text, reader_fn=alpha_num,
-                                 find_spaces=True)
-        self.job = StringFinder('job', Rectangle(610, 595, 320, 40), prepare_fn=dark_text, reader_fn=alpha_num,
-                                find_spaces=True)
-        self.brave = StringFinder('brave', Rectangle(725, 653, 42, 30), prepare_fn=dark_text, reader_fn=small_digit)
-        self.faith = StringFinder('faith', Rectangle(877, 653, 42, 30), prepare_fn=dark_text, reader_fn=small_digit)
-
-    def __call__(self, frame: Node) -> UnitName:
-        name = self.name(frame)
-        job = self.job(frame)
-        brave = self.brave(frame)
-        faith = self.faith(frame)
-        record_low_certainty_string('name', name)
-        record_low_certainty_string('job', job)
-        record_low_certainty_string('brave', brave)
-        record_low_certainty_string('faith', faith)
+        self.finders = [
+            StringFinder('name', Rectangle(610, 545, 320, 40), prepare_fn=dark_text, reader_fn=alpha_num,
+                         find_spaces=True, cache_size=NAME_CACHE_SIZE, cache_path=string_cache_path('name')),
+            StringFinder('job', Rectangle(610, 595, 320, 40), prepare_fn=dark_text, reader_fn=alpha_num,
+                         find_spaces=True, cache_size=NAME_CACHE_SIZE, cache_path=string_cache_path('job')),
+            StringFinder('brave', Rectangle(725, 653, 42, 30), prepare_fn=dark_text, reader_fn=small_digit),
+            StringFinder('faith', Rectangle(877, 653, 42, 30), prepare_fn=dark_text, reader_fn=small_digit),
+        ]
+
+    def __call__(self, frame: Node, executor: Optional[Executor] = None) -> UnitName:
+        return self.from_strings(read_strings(self.finders, frame, executor))
+
+    def from_strings(self, strings: List[String]) -> UnitName:
+        for finder, string in zip(self.finders, strings):
+            record_low_certainty_string(finder.name, string)
+        name, job, brave, faith = strings
         return UnitName(name.to_str(), job.to_str(), brave.to_int(), faith.to_int())
 
 
 class Watcher:
-    def __init__(self):
+    def __init__(self, threads: Optional[int] = None):
+        """
+        With `threads` set, or FINDER_THREADS in the environment, a frame's finders are segmented in a pool of that
+        many threads. `memo_stats` counts how often those frames' shared steps were reused.
+        """
+        if threads is None:
+            threads = int(os.environ.get('FINDER_THREADS', 0))
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='finder') if threads > 0 else None
+        self.memo_stats = MemoStats()
         self.stream_state_model = StreamStateModel()
         self.character_model = CharacterModel()
         self.left_unit_vitals = UnitVitalsReader(self.character_model)
@@ -121,20 +141,62 @@ class Watcher:
         self.ability_reader = StringFinder('ability', Rectangle(270, 122, 425, 58), prepare_fn=dark_text,
                                            reader_fn=self.character_model.read_alpha_num, find_spaces=True)
 
+    def frame(self, image: np.ndarray, lineage: Optional[bool] = None) -> Node:
+        """
+        A node for a frame to watch. With finder threads, its children are kept in a thread-safe `ChildCache`, so the
+        threads share every step they have in common, and all of them stay part of this frame's graph.
+        """
+        children = ChildCache(stats=self.memo_stats) if self.executor is not None else None
+        return Node(image, lineage=lineage, children=children)
+
+    def warm_up(self, *engines):
+        """
+        Loads every model that hasn't been loaded yet, all at once along with any other `engines` given, and the small
+        digit glyphs, rather than waiting for the first frame.
+        """
+        preload_engines([self.stream_state_model.model, self.character_model.small_digit_model,
+                         self.character_model.alphanum_model, *engines])
+        # The glyph index is built the first time it's asked for
+        _ = self.character_model.small_digit_index
+
+    def save_caches(self):
+        """Saves every finder's string cache that has a path, so that its strings are still cached after a restart."""
+        for finder in self.finders:
+            if finder.cache is not None and finder.cache.path is not None:
+                finder.cache.save()
+
+    @property
+    def finders(self) -> List[StringFinder]:
+        return self.left_unit_vitals.finders + self.right_unit_name.finders + [self.ability_reader]
+
     def __call__(self, frame: Node) -> FrameInfo:
-        state = self.stream_state_model(frame)
+        return self.read(frame, self.stream_state_model(frame))
+
+    def read(self, frame: Node, state: StreamState) -> FrameInfo:
+        """
+        Reads everything relevant to the frame's stream state, which has already been classified. The finders only
+        run in threads for a frame made by `frame`, and one after another for any other node.
+        """
         record_low_certainty_stream_state(state, frame)
         state_name = state.name
         if not stream_state.in_game(state_name):
             return FrameInfo(state_name)
 
+        # Only a frame made by `frame` can be shared between the finders' threads
+        executor = self.executor
+        if not (isinstance(frame.children, ChildCache) and frame.children.thread_safe):
+            executor = None
+
         if state_name == stream_state.GAME_SELECT_FULL:
-            vitals = self.left_unit_vitals(frame)
-            name = self.right_unit_name(frame)
+            # Read both panels together, so each font only needs one call to the character model
+            vitals_finders = self.left_unit_vitals.finders
+            strings = read_strings(vitals_finders + self.right_unit_name.finders, frame, executor)
+            vitals = self.left_unit_vitals.from_strings(strings[:len(vitals_finders)])
+            name = self.right_unit_name.from_strings(strings[len(vitals_finders):])
             return FrameInfo(state_name, vitals=vitals, name=name)
 
         elif state_name == stream_state.GAME_SELECT_HALF_LEFT:
-            vitals = self.left_unit_vitals(frame)
+            vitals = self.left_unit_vitals(frame, executor)
             return FrameInfo(state_name, vitals=vitals)
 
         elif state_name == stream_state.GAME_ABILITY_TAG:
@@ -144,3 +206,47 @@ class Watcher:
 
         else:
             return FrameInfo(state_name)
+
+
+FINGERPRINT_CELL_SIZE = 8
+
+
+def frame_fingerprint(frame: Node) -> np.ndarray:
+    """
+    A small grayscale copy of the frame, where each pixel is the mean of a square cell of the original. Area averaging
+    matters here: a plain thumbnail only samples a few pixels per cell, and can miss a single changed digit entirely.
+    """
+    gray = frame.gray.image
+    size = (gray.shape[1] // FINGERPRINT_CELL_SIZE, gray.shape[0] // FINGERPRINT_CELL_SIZE)
+    return cv2.resize(gray, size, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+
+class SkipUnchangedFrames(HitRate):
+    """
+    Sits in front of a `Watcher`, and hands back the previous `FrameInfo` whenever a frame hasn't meaningfully changed,
+    which is most frames on the stream. A frame has changed when any cell of its fingerprint differs by more than
+    `threshold` from the frame that produced the cached `FrameInfo`.
+    """
+
+    def __init__(self, watcher: Watcher, threshold: int = 8):
+        self.watcher = watcher
+        self.threshold = threshold
+        self.last_fingerprint: Optional[np.ndarray] = None
+        self.last_info: Optional[FrameInfo] = None
+        self.hits = 0
+        self.misses = 0
+
+    def frame(self, image: np.ndarray, lineage: Optional[bool] = None) -> Node:
+        return self.watcher.frame(image, lineage)
+
+    def __call__(self, frame: Node) -> FrameInfo:
+        fingerprint = frame_fingerprint(frame)
+        if self.last_fingerprint is not None and self.last_fingerprint.shape == fingerprint.shape:
+            if np.max(np.abs(fingerprint - self.last_fingerprint)) <= self.threshold:
+                self.hits += 1
+                return self.last_info
+
+        self.misses += 1
+        self.last_info = self.watcher(frame)
+        self.last_fingerprint = fingerprint
+        return self.last_info